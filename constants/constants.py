@@ -10,6 +10,11 @@ ITERATIONS = 'iterations'
 INFERENCE_CPU = 'inference_cpu'
 SAMPLE_PERIOD = 'sample_period'
 BATCH_SIZE = 'batch_size'
+INFERENCE_BATCH_SIZE = 'inference_batch_size'
+DENSE_INFERENCE = 'dense_inference'
+INFERENCE_STRIDE = 'inference_stride'
+MC_SAMPLES = 'mc_samples'
+LATENT_SAMPLES = 'latent_samples'
 TRAIN_TEST_SPLIT = 'train_test_split'
 ITERABLE_DATASET = 'iterable_dataset'
 PREPROCESSING_METHOD = 'preprocessing_method'
@@ -37,6 +42,7 @@ COLUMN_RETE = 'RETE'
 COLUMN_HPARAMS = 'hparams'
 COLUMN_GROUNDTRUTH = 'ground'
 COLUMN_PREDICTIONS = 'preds'
+COLUMN_PREDICTIONS_VARIANCE = 'preds_var'
 COLUMN_METRICS = 'metrics'
 COLUMN_MODEL = 'model'
 COLUMN_DATASOURCE = 'datasource'
@@ -50,6 +56,7 @@ DIR_OUTPUT_NAME = 'output'
 DIR_RESULTS_NAME = 'results'
 DIR_PLOTS_NAME = 'plots'
 DIR_SAVED_MODELS_NAME = 'saved_models'
+DIR_CACHE_NAME = 'cache'
 SAVED_MODELS_DIR = 'saved_models_dir'
 EXPERIMENTS_NAME = 'experiments'
 DEFAULT_FINAL_REPORT_NAME = 'final_report'
@@ -96,6 +103,10 @@ PREPROCESSING_PARAMS_NAME = 'preprocessing_params'
 METER_MEANS = 'meter_means'
 METER_STDS = 'meter_stds'
 TESTS_PARAMS = 'tests_params'
+SERIES_CACHE = 'series_cache'
+DATA_LEN = 'data_len'
+MAINS_STATS = 'mains_stats'
+METER_STATS = 'meter_stats'
 EVAL_PARAMS = 'eval_params'
 STAT_REPORT = 'statistical_report'
 MODEL_NAME = 'model_name'
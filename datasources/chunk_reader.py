@@ -0,0 +1,117 @@
+import queue
+import threading
+from typing import Iterator, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+PREFETCH_CHUNKS = 2
+_END = object()
+
+
+class PrefetchingChunkReader:
+    """
+    -PrefetchingChunkReader
+
+    Reads the chunks of the mains & appliance generators in a background thread and keeps up to prefetch pairs of
+    chunks ready in a bounded queue. Thus, the I/O and decoding of the next chunks overlap with the alignment,
+    normalization and training on the consuming thread. If concurrent is True, the mains and the appliance chunk of
+    every pair are also read concurrently by two threads. This is only safe for datasources that can be read from many
+    threads (e.g. ColumnarDatasource), since a NILMTK HDF5 file must not be read by two threads at the same time.
+
+    The thread is started lazily, on the first iteration, and it is joined when the generators are exhausted or the
+    reader is closed. Thus, a reader that is created in the main process and then copied to the forked workers of a
+    DataLoader doesn't carry a dead thread (and its locks) across the fork: each worker starts its own thread.
+
+    Args:
+        mains_generator(Iterator): the generator of the mains chunks
+        appliance_generator(Iterator): the generator of the appliance chunks
+        prefetch(int): the maximum number of pairs of chunks that are read in advance
+            Default: 2
+        concurrent(bool): whether the mains and appliance chunks should be read concurrently or not
+            Default: False
+
+    Example of use:
+        reader = PrefetchingChunkReader(mains_generator, appliance_generator)
+        for mainchunk, meterchunk in reader:
+            mainchunk, meterchunk = align_chunks(mainchunk, meterchunk)
+    """
+    def __init__(self, mains_generator: Iterator[pd.Series], appliance_generator: Iterator[pd.Series],
+                 prefetch: int = PREFETCH_CHUNKS, concurrent: bool = False):
+        self.mains_generator = mains_generator
+        self.appliance_generator = appliance_generator
+        self.concurrent = concurrent
+        self.prefetch = prefetch
+        self.queue = None
+        self.stopped = None
+        self.thread = None
+        self.exhausted = False
+
+    def __iter__(self):
+        self._start()
+        return self
+
+    def __next__(self) -> Tuple[pd.Series, pd.Series]:
+        if self.exhausted:
+            raise StopIteration
+        self._start()
+        item = self.queue.get()
+        if item is _END:
+            self._finish()
+            raise StopIteration
+        if isinstance(item, BaseException):
+            self._finish()
+            raise item
+        return item
+
+    def close(self):
+        self.exhausted = True
+        if self.thread is None:
+            return
+        self.stopped.set()
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.thread.join()
+        self.thread = None
+
+    def _start(self):
+        if self.thread is not None or self.exhausted:
+            return
+        self.queue = queue.Queue(maxsize=self.prefetch)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._produce, daemon=True)
+        self.thread.start()
+
+    def _finish(self):
+        self.exhausted = True
+        self.thread.join()
+        self.thread = None
+
+    def _produce(self):
+        executor = ThreadPoolExecutor(max_workers=1) if self.concurrent else None
+        try:
+            while not self.stopped.is_set():
+                if executor is not None:
+                    appliance_future = executor.submit(next, self.appliance_generator, _END)
+                    mainchunk = next(self.mains_generator, _END)
+                    meterchunk = appliance_future.result()
+                else:
+                    mainchunk = next(self.mains_generator, _END)
+                    meterchunk = next(self.appliance_generator, _END) if mainchunk is not _END else _END
+                if mainchunk is _END or meterchunk is _END:
+                    self._put(_END)
+                    return
+                self._put((mainchunk, meterchunk))
+        except Exception as e:
+            self._put(e)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
@@ -0,0 +1,233 @@
+import os
+import json
+from typing import Iterator, List
+
+import numpy as np
+import pandas as pd
+
+from datasources.paths_manager import COLUMNAR_DIR
+
+MANIFEST_FILE = 'manifest.json'
+TIMESTAMPS_FILE = 'timestamps.npy'
+VALUES_FILE = 'values.npy'
+MAINS = 'mains'
+APPLIANCES = 'appliances'
+MAX_SAMPLE_PERIODS = 'max_sample_periods'
+BUILDINGS = 'buildings'
+TIMEZONE = 'timezone'
+
+
+class ColumnarDatasource:
+    """
+    -ColumnarDatasource
+
+    A datasource that reads the measurements from a columnar store, which is created once from the NILMTK HDF5 file of
+    a dataset by export_to_columnar. It has the same interface as Datasource (get_mains_generator,
+    get_appliance_generator), but it doesn't depend on NILMTK: the meters are memory-mapped .npy files and the
+    date windowing (searchsorted), resampling (bincount) and forward filling are vectorized numpy operations.
+    Only the returned chunks are wrapped in pandas Series, so that they can be aligned like the NILMTK ones.
+
+    The layout of the store is:
+        <root>/<name>/manifest.json
+        <root>/<name>/building<building>/meter<instance>/timestamps.npy (int64 UTC nanoseconds)
+        <root>/<name>/building<building>/meter<instance>/values.npy (float32 active power)
+    where the manifest keeps the timezone of the dataset and, for every building, the meters of the mains and of
+    every appliance (the same meters that Datasource selects) and the max sample period of every meter.
+
+    Args:
+        name(str): the name of the dataset, e.g. UKDALE
+        root(str): the root directory of the columnar stores
+            Default: COLUMNAR_DIR of datasources/paths_manager.py
+    """
+    # the meters are read-only memory maps, so many threads can read them at the same time
+    thread_safe = True
+
+    def __init__(self, name: str, root: str = COLUMNAR_DIR):
+        self.name = name
+        self.root = os.path.join(root, name)
+        self.path = os.path.join(self.root, MANIFEST_FILE)
+        with open(self.path, 'r') as manifest_file:
+            self.manifest = json.load(manifest_file)
+        self.timezone = self.manifest.get(TIMEZONE)
+        self.meters = {}
+
+    @staticmethod
+    def exists(name: str, root: str = COLUMNAR_DIR) -> bool:
+        return os.path.exists(os.path.join(root, name, MANIFEST_FILE))
+
+    @staticmethod
+    def is_manifest(path: str) -> bool:
+        return bool(path) and os.path.basename(path) == MANIFEST_FILE
+
+    def get_dataset(self):
+        return None
+
+    def get_name(self):
+        return self.name
+
+    def get_path(self):
+        return self.path
+
+    def close(self):
+        self.meters = {}
+
+    def get_mains_generator(self, start: str, end: str, sample_period: int = 6, building: int = 1,
+                            chunksize: int = 1000) -> Iterator[pd.Series]:
+        meters = self._get_building(building)[MAINS]
+        return self._power_series(building, meters, start, end, sample_period, chunksize)
+
+    def get_appliance_generator(self, appliance: str, start: str, end: str, sample_period: int = 6,
+                                building: int = 1, chunksize: int = None) -> Iterator[pd.Series]:
+        appliances = self._get_building(building)[APPLIANCES]
+        if appliance not in appliances:
+            raise KeyError('Appliance {} was not exported for building {} of {}'.format(appliance, building,
+                                                                                       self.name))
+        return self._power_series(building, appliances[appliance], start, end, sample_period, chunksize)
+
+    def _get_building(self, building: int) -> dict:
+        return self.manifest[BUILDINGS][str(building)]
+
+    def _load_meter(self, building: int, meter: int):
+        if (building, meter) not in self.meters:
+            meter_dir = os.path.join(self.root, 'building{}'.format(building), 'meter{}'.format(meter))
+            self.meters[(building, meter)] = (np.load(os.path.join(meter_dir, TIMESTAMPS_FILE), mmap_mode='r'),
+                                              np.load(os.path.join(meter_dir, VALUES_FILE), mmap_mode='r'))
+        return self.meters[(building, meter)]
+
+    def _to_nanoseconds(self, date):
+        if date is None or (isinstance(date, str) and not date):
+            return None
+        timestamp = pd.Timestamp(date)
+        if timestamp.tzinfo is None and self.timezone:
+            timestamp = timestamp.tz_localize(self.timezone)
+        return timestamp.value
+
+    def _power_series(self, building: int, meters: List[int], start: str, end: str, sample_period: int,
+                      chunksize: int) -> Iterator[pd.Series]:
+        """
+        Resamples every meter of the group on the same grid of sample_period bins and sums them, like a NILMTK
+        MeterGroup does. The chunks of the summed series are yielded with a DatetimeIndex in the dataset timezone.
+        """
+        start, end = self._to_nanoseconds(start), self._to_nanoseconds(end)
+        period = int(sample_period * 10 ** 9)
+        resampled = []
+        for meter in meters:
+            timestamps, values = self._load_meter(building, meter)
+            max_sample_period = self._get_building(building)[MAX_SAMPLE_PERIODS].get(str(meter))
+            meter_series = resample_meter(timestamps, values, start, end, period, max_sample_period)
+            if meter_series is not None:
+                resampled.append(meter_series)
+        if not resampled:
+            return
+
+        first_bin = min(bin_start for bin_start, _ in resampled)
+        last_bin = max(bin_start + len(values) for bin_start, values in resampled)
+        total = np.full(last_bin - first_bin, np.nan, dtype=np.float32)
+        for bin_start, values in resampled:
+            segment = total[bin_start - first_bin: bin_start - first_bin + len(values)]
+            segment[:] = np.where(np.isnan(segment), values, np.where(np.isnan(values), segment, segment + values))
+
+        index = pd.to_datetime(np.arange(first_bin, last_bin, dtype=np.int64) * period, utc=True)
+        if self.timezone:
+            index = index.tz_convert(self.timezone)
+        chunksize = chunksize or len(total)
+        for chunk_start in range(0, len(total), chunksize):
+            yield pd.Series(total[chunk_start:chunk_start + chunksize],
+                            index=index[chunk_start:chunk_start + chunksize])
+
+
+def resample_meter(timestamps: np.array, values: np.array, start: int, end: int, period: int,
+                   max_sample_period: float = None):
+    """
+    Averages the measurements of [start, end) in bins of period nanoseconds. The empty bins are forward filled up to
+    the max sample period of the meter, like NILMTK does, and are NaN after that.
+    Returns the first bin and the values of the bins, or None if there are no measurements in the window.
+    """
+    lower = 0 if start is None else np.searchsorted(timestamps, start, side='left')
+    upper = len(timestamps) if end is None else np.searchsorted(timestamps, end, side='left')
+    if upper <= lower:
+        return None
+    bins = np.asarray(timestamps[lower:upper]) // period
+    first_bin = int(bins[0])
+    bins = bins - first_bin
+    counts = np.bincount(bins)
+    sums = np.bincount(bins, weights=np.asarray(values[lower:upper], dtype=np.float64))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    if max_sample_period:
+        # the same limit as ElecMeter: resample_kwargs['limit'] = ceil(max_sample_period / sample_period) rows
+        limit = int(np.ceil(max_sample_period * 10 ** 9 / period))
+        means = forward_fill(means, limit)
+    return first_bin, means.astype(np.float32)
+
+
+def forward_fill(values: np.array, limit: int):
+    if limit <= 0:
+        return values
+    positions = np.arange(len(values))
+    last_valid = np.where(np.isnan(values), -1, positions)
+    np.maximum.accumulate(last_valid, out=last_valid)
+    fill = (last_valid >= 0) & (positions - last_valid <= limit)
+    return values[np.where(fill, last_valid, positions)]
+
+
+def export_to_columnar(dataset_name: str, path: str, output_dir: str = COLUMNAR_DIR, buildings: list = None,
+                       chunksize: int = 10 ** 7):
+    """
+    Exports the buildings of a NILMTK HDF5 dataset (e.g. UKDALE, REDD, REFIT) to a columnar store that can be read by
+    ColumnarDatasource. Every meter is exported once at its native sampling, the meters of the mains and of every
+    appliance are selected in the same way as Datasource does. NILMTK is needed only for the export.
+
+    Example of use:
+        export_to_columnar(NAME_UK_DALE, UK_DALE)
+        datasource = ColumnarDatasource(NAME_UK_DALE)
+    """
+    from datasources.datasource import Datasource
+    from nilmtk import DataSet
+
+    datasource = Datasource(DataSet(path), dataset_name, path)
+    dataset = datasource.get_dataset()
+    root = os.path.join(output_dir, dataset_name)
+    manifest = {TIMEZONE: dataset.metadata.get(TIMEZONE), BUILDINGS: {}}
+    for building in buildings or list(dataset.buildings):
+        elec = dataset.buildings[building].elec
+        groups = {MAINS: datasource._get_mains_meter_group(building).all_meters(), APPLIANCES: {}}
+        for appliance in sorted({appliance.type['type'] for appliance in elec.appliances}):
+            try:
+                metergroup = datasource.get_selected_metergroup([appliance], building, include_mains=False)
+            except Exception:
+                continue
+            if len(metergroup.meters):
+                groups[APPLIANCES][appliance] = metergroup.all_meters()
+
+        exported = {}
+        for meter in groups[MAINS] + [meter for meters in groups[APPLIANCES].values() for meter in meters]:
+            instance = meter.instance()
+            if instance not in exported:
+                meter_dir = os.path.join(root, 'building{}'.format(building), 'meter{}'.format(instance))
+                _export_meter(meter, meter_dir, chunksize)
+                exported[instance] = meter.device.get('max_sample_period')
+
+        manifest[BUILDINGS][str(building)] = {
+            MAINS: [meter.instance() for meter in groups[MAINS]],
+            APPLIANCES: {appliance: [meter.instance() for meter in meters]
+                         for appliance, meters in groups[APPLIANCES].items()},
+            MAX_SAMPLE_PERIODS: {str(instance): max_sample_period for instance, max_sample_period in exported.items()},
+        }
+
+    with open(os.path.join(root, MANIFEST_FILE), 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+
+
+def _export_meter(meter, meter_dir: str, chunksize: int):
+    timestamps, values = [], []
+    for chunk in meter.power_series(chunksize=chunksize):
+        timestamps.append(chunk.index.asi8)
+        values.append(chunk.values.astype(np.float32))
+    timestamps = np.concatenate(timestamps) if timestamps else np.array([], dtype=np.int64)
+    values = np.concatenate(values) if values else np.array([], dtype=np.float32)
+    order = np.argsort(timestamps, kind='stable')
+    timestamps, unique_positions = np.unique(timestamps[order], return_index=True)
+    os.makedirs(meter_dir, exist_ok=True)
+    np.save(os.path.join(meter_dir, TIMESTAMPS_FILE), timestamps)
+    np.save(os.path.join(meter_dir, VALUES_FILE), values[order][unique_positions])
@@ -1,4 +1,7 @@
+import os
 import time
+import atexit
+import threading
 from typing import List, Tuple, Iterator
 
 import matplotlib.pyplot as plt
@@ -6,9 +9,11 @@ import numpy as np
 import pandas as pd
 from fuzzywuzzy import fuzz
 from nilmtk import DataSet, MeterGroup
+from nilmtk.timeframe import TimeFrame
 from pandas import DataFrame
 
 from datasources.paths_manager import UK_DALE, REDD, REFIT
+from datasources.columnar_datasource import ColumnarDatasource
 from exceptions.lab_exceptions import LabelNormalizationError
 from utils.logger import timing, TIMING, info, debug
 
@@ -19,10 +24,13 @@ SITE_METER = 'Site meter'
 
 
 class Datasource():
+    # a NILMTK HDF5 file must not be read by more than one thread at the same time
+    thread_safe = False
 
-    def __init__(self, dataset: DataSet, name: str):
+    def __init__(self, dataset: DataSet, name: str, path: str = None):
         self.dataset = dataset
         self.name = name
+        self.path = path
 
     def get_dataset(self):
         return self.dataset
@@ -30,16 +38,26 @@ class Datasource():
     def get_name(self):
         return self.name
 
+    def get_path(self):
+        return self.path
+
+    def close(self):
+        store = getattr(self.dataset, 'store', None)
+        if store is not None:
+            store.close()
+
     def get_mains_generator(self, start: str, end: str, sample_period: int = 6, building: int = 1,
                             chunksize: int = 1000) -> Iterator[pd.Series]:
-        mains_metergroup = self._get_mains_meter_group(building, start, end)
-        mains_power_gen = mains_metergroup.power_series(sample_period=sample_period, chunksize=chunksize)
+        mains_metergroup = self._get_mains_meter_group(building)
+        mains_power_gen = mains_metergroup.power_series(sample_period=sample_period, chunksize=chunksize,
+                                                        sections=self._sections(start, end))
         return mains_power_gen
 
     def get_appliance_generator(self, appliance: str, start: str, end: str, sample_period: int = 6,
                                 building: int = 1, chunksize: int = None) -> Iterator[pd.Series]:
-        selected_metergroup = self.get_selected_metergroup([appliance], building, end, start, include_mains=False)
-        appliance_power_gen = selected_metergroup.power_series(sample_period=sample_period, chunksize=chunksize)
+        selected_metergroup = self.get_selected_metergroup([appliance], building, include_mains=False)
+        appliance_power_gen = selected_metergroup.power_series(sample_period=sample_period, chunksize=chunksize,
+                                                               sections=self._sections(start, end))
         return appliance_power_gen
 
     def read_all_meters(self, start: str, end: str, sample_period: int = 6, building: int = 1) \
@@ -56,12 +74,11 @@ class Datasource():
             Returns a tuple containing the respective DataFrame and MeterGroup of the data that are read.
         """
         start_time = time.time() if TIMING else None
-        self.dataset.set_window(start=start, end=end)
         elec = self.dataset.buildings[building].elec
         timing('NILMTK selecting all meters: {}'.format(round(time.time() - start_time, 2)))
 
         start_time = time.time() if TIMING else None
-        df = elec.dataframe_of_meters(sample_period=sample_period)
+        df = elec.dataframe_of_meters(sample_period=sample_period, sections=self._sections(start, end))
         timing('NILMTK converting all meters to dataframe: {}'.format(round(time.time() - start_time, 2)))
 
         df.fillna(0, inplace=True)
@@ -84,10 +101,10 @@ class Datasource():
         """
         debug(f" read_selected_appliances {appliances}, {building}, {start}, {end}, {include_mains}")
 
-        selected_metergroup = self.get_selected_metergroup(appliances, building, end, start, include_mains)
+        selected_metergroup = self.get_selected_metergroup(appliances, building, include_mains)
 
         start_time = time.time() if TIMING else None
-        df = selected_metergroup.dataframe_of_meters(sample_period=sample_period)
+        df = selected_metergroup.dataframe_of_meters(sample_period=sample_period, sections=self._sections(start, end))
         timing('NILMTK converting specified appliances to dataframe: {}'.format(round(time.time() - start_time, 2)))
 
         debug(f"Length of data of read_selected_appliances {len(df)}")
@@ -106,16 +123,23 @@ class Datasource():
         Returns:
             Returns a tuple containing the respective DataFrame and MeterGroup of the data that are read.
         """
-        mains_metergroup = self._get_mains_meter_group(building, start, end)
+        mains_metergroup = self._get_mains_meter_group(building)
         start_time = time.time() if TIMING else None
-        df = mains_metergroup.dataframe_of_meters(sample_period=sample_period)
+        df = mains_metergroup.dataframe_of_meters(sample_period=sample_period, sections=self._sections(start, end))
         timing('NILMTK converting mains to dataframe: {}'.format(round(time.time() - start_time, 2)))
 
         df.fillna(0, inplace=True)
         return df, mains_metergroup
 
-    def _get_mains_meter_group(self, building, start, end):
-        self.dataset.set_window(start=start, end=end)
+    def _sections(self, start: str, end: str) -> List[TimeFrame]:
+        """
+        The date range is passed to every load of the meters as a section, instead of being set as the window of the
+        DataSet, which is shared by all the users of a pooled datasource (check: DatasourcePool). Thus, generators of
+        different date ranges of the same dataset can be consumed at the same time.
+        """
+        return [TimeFrame(start=start, end=end, tz=self.dataset.metadata.get('timezone'))]
+
+    def _get_mains_meter_group(self, building):
         mains_meter = self.dataset.buildings[building].elec.mains()
         if isinstance(mains_meter, MeterGroup):
             mains_metergroup = mains_meter
@@ -123,21 +147,19 @@ class Datasource():
             mains_metergroup = MeterGroup(meters=[mains_meter])
         return mains_metergroup
 
-    def get_selected_metergroup(self, appliances, building, end, start, include_mains) -> MeterGroup:
+    def get_selected_metergroup(self, appliances, building, include_mains) -> MeterGroup:
         """
-        Gets a MeterGroup with the specified appliances for the given building during the given dates.
+        Gets a MeterGroup with the specified appliances for the given building. The dates of the records are given
+        when the meters are loaded.
         Args:
             appliances (List): A list of appliances to read their records.
             building (int): The building to read the records from.
-            start (str): The starting date in the format "{month}-{day of month}-{year}" e.g. "05-30-2012".
-            end (str): The final date in the format "{month}-{day of month}-{year}" e.g. "08-30-2012".
             include_mains (bool): True if should include main meters.
 
         Returns:
             A MeterGroup containing the specified appliances.
         """
         start_time = time.time() if TIMING else None
-        self.dataset.set_window(start=start, end=end)
         elec = self.dataset.buildings[building].elec
         appliances_with_one_meter = []
         appliances_with_more_meters = []
@@ -244,13 +266,90 @@ class Datasource():
         timing('None to num: {}'.format(round(time.time() - start_time, 2)))
 
 
+class DatasourcePool:
+    """
+    A process-wide pool of opened datasources, keyed by dataset name and path, so that the HDF5 file of a dataset is
+    opened and its metadata are parsed only once per process, no matter how many train/test houses are read from it.
+
+    Every acquire increases the reference count of the datasource and every release decreases it. Datasources that are
+    not referenced stay open for later use, until close_idle is called, and all the handles are closed on exit.
+    The pool is safe across forks (e.g. dataloader workers): a child process never uses or closes the handles that
+    were opened by its parent, it opens its own.
+    The window of the pooled nilmtk DataSet is never set, the date range is passed to every load instead, so the users
+    of a pooled datasource don't interfere with each other.
+    """
+    _lock = threading.Lock()
+    _pid = os.getpid()
+    _datasources = {}
+    _refcounts = {}
+
+    @classmethod
+    def acquire(cls, dataset_name: str, path: str) -> Datasource:
+        with cls._lock:
+            cls._check_pid()
+            key = (dataset_name, os.path.abspath(path))
+            if key not in cls._datasources:
+                cls._datasources[key] = Datasource(DataSet(path), dataset_name, path)
+                cls._refcounts[key] = 0
+            cls._refcounts[key] += 1
+            return cls._datasources[key]
+
+    @classmethod
+    def release(cls, datasource: Datasource):
+        if not isinstance(datasource, Datasource):
+            return
+        with cls._lock:
+            cls._check_pid()
+            key = (datasource.get_name(), os.path.abspath(datasource.get_path()))
+            if cls._refcounts.get(key, 0) > 0:
+                cls._refcounts[key] -= 1
+
+    @classmethod
+    def close_idle(cls):
+        with cls._lock:
+            cls._check_pid()
+            for key in [key for key, refcount in cls._refcounts.items() if refcount == 0]:
+                cls._datasources.pop(key).close()
+                del cls._refcounts[key]
+
+    @classmethod
+    def close_all(cls):
+        with cls._lock:
+            cls._check_pid()
+            for datasource in cls._datasources.values():
+                datasource.close()
+            cls._datasources = {}
+            cls._refcounts = {}
+
+    @classmethod
+    def _check_pid(cls):
+        if cls._pid != os.getpid():
+            cls._reset_after_fork()
+
+    @classmethod
+    def _reset_after_fork(cls):
+        cls._lock = threading.Lock()
+        cls._pid = os.getpid()
+        cls._datasources = {}
+        cls._refcounts = {}
+
+
+atexit.register(DatasourcePool.close_all)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=DatasourcePool._reset_after_fork)
+
+
 class DatasourceFactory:
     """
     It is responsible to create different data sources that are based on various data sets.
+    The opened data sets are shared through the DatasourcePool. If a data set has been exported to a columnar store
+    (check: datasources/columnar_datasource), the NILMTK-free ColumnarDatasource is created instead.
     """
 
     @staticmethod
     def create_datasource(dataset_name:str):
+        if ColumnarDatasource.exists(dataset_name):
+            return ColumnarDatasource(dataset_name)
         if dataset_name == NAME_UK_DALE:
             return DatasourceFactory.create_uk_dale_datasource()
         elif dataset_name == NAME_REDD:
@@ -258,9 +357,19 @@ class DatasourceFactory:
         elif dataset_name == NAME_REFIT:
             return DatasourceFactory.create_refit_datasource()
 
+    @staticmethod
+    def open_datasource(dataset_name: str, path: str):
+        """
+        Returns the datasource of the given HDF5 file, e.g. in a worker process, which gets its own handles from the
+        pool instead of the ones of its parent.
+        """
+        if ColumnarDatasource.is_manifest(path):
+            return ColumnarDatasource(dataset_name, os.path.dirname(os.path.dirname(path)))
+        return DatasourcePool.acquire(dataset_name, path)
+
     @staticmethod
     def create_uk_dale_datasource():
-        return Datasource(DatasourceFactory.get_uk_dale_dataset(), NAME_UK_DALE)
+        return DatasourcePool.acquire(NAME_UK_DALE, UK_DALE)
 
     @staticmethod
     def get_uk_dale_dataset():
@@ -268,7 +377,7 @@ class DatasourceFactory:
 
     @staticmethod
     def create_redd_datasource():
-        return Datasource(DatasourceFactory.get_redd_dataset(), NAME_REDD)
+        return DatasourcePool.acquire(NAME_REDD, REDD)
 
     @staticmethod
     def get_redd_dataset():
@@ -276,7 +385,7 @@ class DatasourceFactory:
 
     @staticmethod
     def create_refit_datasource():
-        return Datasource(DatasourceFactory.get_refit_dataset(), NAME_REFIT)
+        return DatasourcePool.acquire(NAME_REFIT, REFIT)
 
     @staticmethod
     def get_refit_dataset():
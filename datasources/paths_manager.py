@@ -5,6 +5,7 @@ dirname = os.path.dirname(__file__)
 UK_DALE = os.path.join(dirname, '../../Datasets/UKDALE/UKDALE.h5')
 REDD = os.path.join(dirname, '../../Datasets/REDD/redd.h5')
 REFIT = os.path.join(dirname, '../../Datasets/REFIT/REFIT.h5')
+COLUMNAR_DIR = os.path.join(dirname, '../../Datasets/columnar')
 
 
 MODEL_CKPT_PATH = 'model/'
@@ -1,8 +1,12 @@
 import warnings
 
 import numpy as np
+import torch
+import torch.nn.functional as F
 from skimage.restoration import denoise_wavelet
 
+from constants.enumerates import SupportedFillingMethods
+
 
 def apply_rolling_window(mainchunk: np.array, meterchunk: np.array, window_size: int):
     if not window_size:
@@ -24,31 +28,184 @@ def apply_midpoint_window(mainchunk: np.array, meterchunk: np.array, window_size
 
 
 def apply_sequence_to_subsequence(mainchunk: np.array, meterchunk: np.array, sequence_window: int,
-                                  subsequence_window: int):
+                                  subsequence_window: int, stride: int = 1):
     if not sequence_window:
         raise Warning('Sequence window is not defined.')
     if not subsequence_window:
         warnings.warn('Sub sequence window is not defined. So the 20% of sequence window was used.')
         subsequence_window = int(sequence_window * 0.2)
+    check_stride(stride, subsequence_window)
     upper_limit = (sequence_window + subsequence_window) // 2
     lower_limit = (sequence_window - subsequence_window) // 2
-    sequence_indexer = np.arange(sequence_window)[None, :] + np.arange(len(mainchunk) - sequence_window + 1)[:, None]
+    starts = np.arange(0, len(mainchunk) - sequence_window + 1, stride)
+    sequence_indexer = np.arange(sequence_window)[None, :] + starts[:, None]
     mainchunk = mainchunk[sequence_indexer]
 
-    subsequence_indexer = np.arange(sequence_window)[lower_limit: upper_limit] + np.arange(len(mainchunk))[:, None]
+    subsequence_indexer = np.arange(sequence_window)[lower_limit: upper_limit] + starts[:, None]
     meterchunk = meterchunk[subsequence_indexer]
     return mainchunk, meterchunk
 
 
-def apply_sequence_to_sequence(mainchunk: np.array, meterchunk: np.array, sequence_window: int):
+def apply_sequence_to_sequence(mainchunk: np.array, meterchunk: np.array, sequence_window: int, stride: int = 1):
     if not sequence_window:
         raise Warning('Sequence window is not defined.')
-    sequence_indexer = np.arange(sequence_window)[None, :] + np.arange(len(mainchunk) - sequence_window + 1)[:, None]
+    check_stride(stride, sequence_window)
+    sequence_indexer = np.arange(sequence_window)[None, :] + \
+        np.arange(0, len(mainchunk) - sequence_window + 1, stride)[:, None]
     mainchunk = mainchunk[sequence_indexer]
     meterchunk = meterchunk[sequence_indexer]
     return mainchunk, meterchunk
 
 
+def check_stride(stride: int, output_window: int):
+    # the windows must cover every sample of the timeline, otherwise the outputs can't be reconstructed on it
+    if stride < 1 or stride > output_window:
+        raise Warning('The stride of the windows must be between 1 and the output window ({}).'.format(output_window))
+
+
+def window_view(series: torch.Tensor, window_size: int, stride: int = 1):
+    if len(series) < window_size:
+        return series.new_empty((0, window_size))
+    return series.unfold(0, window_size, stride)
+
+
+def rolling_window_view(mainseries: torch.Tensor, meterseries: torch.Tensor, window_size: int):
+    if not window_size:
+        raise Warning('Window size is not defined.')
+    mainchunk = window_view(mainseries, window_size)
+    meterchunk = meterseries[window_size - 1:]
+    return mainchunk, meterchunk
+
+
+def midpoint_window_view(mainseries: torch.Tensor, meterseries: torch.Tensor, window_size: int):
+    if not window_size:
+        raise Warning('Window size is not defined.')
+    mainchunk = window_view(mainseries, window_size)
+    midpoint = window_size // 2
+    meterchunk = meterseries[midpoint: len(mainchunk) + midpoint]
+    return mainchunk, meterchunk
+
+
+def sequence_to_subsequence_view(mainseries: torch.Tensor, meterseries: torch.Tensor, sequence_window: int,
+                                 subsequence_window: int, stride: int = 1):
+    if not sequence_window:
+        raise Warning('Sequence window is not defined.')
+    if not subsequence_window:
+        warnings.warn('Sub sequence window is not defined. So the 20% of sequence window was used.')
+        subsequence_window = int(sequence_window * 0.2)
+    check_stride(stride, subsequence_window)
+    upper_limit = (sequence_window + subsequence_window) // 2
+    lower_limit = (sequence_window - subsequence_window) // 2
+    mainchunk = window_view(mainseries, sequence_window, stride)
+    meterchunk = window_view(meterseries[lower_limit:], upper_limit - lower_limit, stride)[:len(mainchunk)]
+    return mainchunk, meterchunk
+
+
+def sequence_to_sequence_view(mainseries: torch.Tensor, meterseries: torch.Tensor, sequence_window: int,
+                              stride: int = 1):
+    if not sequence_window:
+        raise Warning('Sequence window is not defined.')
+    check_stride(stride, sequence_window)
+    mainchunk = window_view(mainseries, sequence_window, stride)
+    meterchunk = window_view(meterseries, sequence_window, stride)
+    return mainchunk, meterchunk
+
+
+def overlap_add(windows: torch.Tensor, stride: int = 1):
+    """
+    Reconstructs the timeline of overlapping sequence outputs, [num_windows, window_size] where window i starts at
+    i * stride. The windows are overlap-added with a strided fold and every sample is averaged over the windows that
+    cover it (check: OverlapAdder).
+    """
+    adder = OverlapAdder(stride, num_windows=len(windows))
+    adder.update(windows)
+    return adder.compute()
+
+
+class OverlapAdder:
+    """
+    -OverlapAdder
+
+    Overlap-adds a stream of batches of windows, [batch_size, window_size] where the i-th window of the stream starts
+    at i * stride, in preallocated sum & count buffers with one value per timestamp. Every batch is folded in as
+    soon as it is produced, so only the timeline, and not all the windows, is kept in memory. If the number of
+    windows isn't known in advance (e.g. iterable datasets), the buffers grow as needed.
+
+    Args:
+        stride(int): the distance of consecutive windows on the timeline
+            Default: 1
+        num_windows(int): the total number of windows of the stream, if it's known in advance
+            Default: None
+
+    Example of use:
+        adder = OverlapAdder(stride, num_windows=len(dataset))
+        for outputs in batches:
+            adder.update(outputs)
+        timeline = adder.compute()
+    """
+    def __init__(self, stride: int = 1, num_windows: int = None):
+        self.stride = stride
+        self.num_windows = num_windows
+        self.seen = 0
+        self.window_size = None
+        self.sums = None
+        self.counts = None
+
+    def update(self, windows: torch.Tensor):
+        if not len(windows):
+            return
+        batch_size, window_size = windows.shape
+        if self.sums is None:
+            self.window_size = window_size
+            self._allocate(self._timeline_length(self.num_windows or batch_size), windows)
+        start = self.seen * self.stride
+        end = start + self._timeline_length(batch_size)
+        if end > len(self.sums):
+            self._allocate(max(end, 2 * len(self.sums)), windows)
+        fold_args = dict(output_size=(1, end - start), kernel_size=(1, window_size), stride=(1, self.stride))
+        self.sums[start:end] += F.fold(windows.t().unsqueeze(0), **fold_args).view(-1)
+        self.counts[start:end] += self._coverage(batch_size)
+        self.seen += batch_size
+
+    def compute(self) -> torch.Tensor:
+        if self.sums is None:
+            return torch.empty(0)
+        length = self._timeline_length(self.seen)
+        return self.sums[:length] / self.counts[:length].clamp(min=1)
+
+    def _timeline_length(self, num_windows: int) -> int:
+        return (num_windows - 1) * self.stride + self.window_size
+
+    def _allocate(self, length: int, windows: torch.Tensor):
+        sums, counts = self.sums, self.counts
+        self.sums = windows.new_zeros(length)
+        self.counts = windows.new_zeros(length)
+        if sums is not None:
+            self.sums[:len(sums)] = sums
+            self.counts[:len(counts)] = counts
+
+    def _coverage(self, batch_size: int) -> torch.Tensor:
+        """
+        The number of windows of a batch that cover every timestamp of its segment of the timeline, i.e. the fold
+        of a [batch_size, window_size] matrix of ones, calculated without materializing it.
+        """
+        t = torch.arange(self._timeline_length(batch_size), device=self.counts.device)
+        last = torch.clamp(t // self.stride, max=batch_size - 1)
+        first = (torch.clamp(t - self.window_size + 1, min=0) + self.stride - 1) // self.stride
+        return (last - first + 1).to(self.counts.dtype)
+
+
+def series_from_windows(windows: torch.Tensor, stride: int = 1):
+    """
+    Returns the series that the windows, [num_windows, window_size] where window i starts at i * stride, were taken
+    from, e.g. the target series of a SEQ_T0_SEQ or SEQ_T0_SUBSEQ dataset. No values are averaged, since the
+    overlapping values of the windows are the same.
+    """
+    if not len(windows):
+        return windows.new_empty(0)
+    return torch.cat((windows[:-1, :stride].reshape(-1), windows[-1]))
+
+
 def create_batches(mainchunk: np.array, meterchunk: np.array, seq_len: int):
     ix = mainchunk.index
     additional = seq_len - (len(ix) % seq_len)
@@ -73,6 +230,12 @@ def replace_nans_interpolation(mainchunk: np.array, meterchunk: np.array):
     return mainchunk, meterchunk
 
 
+def fill_nans(mainchunk: np.array, meterchunk: np.array, fillna_method: SupportedFillingMethods):
+    if fillna_method == SupportedFillingMethods.FILL_INTERPOLATION:
+        mainchunk, meterchunk = replace_nans_interpolation(mainchunk, meterchunk)
+    return replace_nans(mainchunk, meterchunk)
+
+
 def normalize_chunks(mainchunk: np.array, meterchunk: np.array, mmax: float):
     if mmax is None:
         mmax = mainchunk.max()
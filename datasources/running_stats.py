@@ -0,0 +1,65 @@
+import math
+from typing import Optional
+
+import numpy as np
+
+COUNT = 'count'
+MEAN = 'mean'
+M2 = 'm2'
+MAX = 'max'
+
+
+class RunningStats:
+    """
+    -RunningStats
+
+    Single-pass statistics (count, mean, M2 and max) of a time series that is seen one chunk at a time, so that the
+    normalization parameters of a whole date range can be calculated without keeping the range in memory. Every chunk
+    is summarized with numpy and merged with the running statistics with the parallel form of Welford's algorithm
+    (Chan et al.), which is numerically stable no matter how many chunks there are. The std is the sample std
+    (ddof=1), the same as the std that is calculated on a whole series.
+
+    Example of use:
+        stats = RunningStats()
+        for chunk in chunks:
+            stats.update(chunk)
+        means, stds, mmax = stats.mean, stats.std, stats.max
+    """
+    def __init__(self, count: int = 0, mean: float = 0.0, m2: float = 0.0, max: float = None):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.max = max
+
+    def update(self, chunk: np.array):
+        chunk = np.asarray(chunk, dtype=np.float64)
+        if not len(chunk):
+            return
+        chunk_mean = chunk.mean()
+        self.merge(RunningStats(count=len(chunk),
+                                mean=chunk_mean,
+                                m2=float(((chunk - chunk_mean) ** 2).sum()),
+                                max=chunk.max()))
+
+    def merge(self, other: 'RunningStats'):
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = float(self.mean + delta * other.count / count)
+        self.m2 = float(self.m2 + other.m2 + delta ** 2 * self.count * other.count / count)
+        self.max = float(other.max) if self.max is None else float(max(self.max, other.max))
+        self.count = count
+
+    @property
+    def std(self) -> Optional[float]:
+        if self.count < 2:
+            return None
+        return math.sqrt(self.m2 / (self.count - 1))
+
+    def to_dict(self) -> dict:
+        return {COUNT: self.count, MEAN: self.mean, M2: self.m2, MAX: self.max}
+
+    @staticmethod
+    def from_dict(values: dict) -> 'RunningStats':
+        return RunningStats(count=values[COUNT], mean=values[MEAN], m2=values[M2], max=values[MAX])
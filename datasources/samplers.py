@@ -0,0 +1,62 @@
+from typing import Iterator, Union
+
+import torch
+from torch.utils.data import Sampler
+
+
+class BlockBatchSampler(Sampler):
+    """
+    -BlockBatchSampler
+
+    A sampler that yields whole batches of indices instead of single indices. It is meant to be used with a pytorch
+    DataLoader with batch_size=None, so that the map-style electricity datasets return a (B, W) batch with a single
+    slice/gather of the windows, without calling __getitem__ B times and stacking the results in default_collate.
+
+    Args:
+        indices(int or torch.Tensor): the indices of the dataset to sample from. If an int is given, all the
+            indices in range(indices) are used.
+        batch_size(int): the number of indices of every block
+        shuffle(bool): if True, the indices are re-shuffled in every epoch, exactly like a RandomSampler.
+            If False, the indices are given in order and when they are a contiguous range the blocks are python slices,
+            so the dataset returns views without any copy.
+            Default: False
+        drop_last(bool): whether the last incomplete block should be dropped or not
+            Default: False
+        generator(torch.Generator): the generator used for the shuffling
+
+    Example of use:
+        train_sampler = BlockBatchSampler(train_indices, batch_size=BATCH, shuffle=True)
+        train_loader = DataLoader(train_dataset_all, batch_size=None, sampler=train_sampler, num_workers=8)
+    """
+    def __init__(self, indices: Union[int, torch.Tensor], batch_size: int, shuffle: bool = False,
+                 drop_last: bool = False, generator: torch.Generator = None):
+        if isinstance(indices, int):
+            self.indices = None
+            self.num_samples = indices
+        else:
+            self.indices = torch.as_tensor(indices, dtype=torch.long)
+            self.num_samples = len(self.indices)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.generator = generator
+
+    def __iter__(self) -> Iterator[Union[slice, torch.Tensor]]:
+        if self.shuffle:
+            order = torch.randperm(self.num_samples, generator=self.generator)
+            if self.indices is not None:
+                order = self.indices[order]
+        else:
+            order = self.indices
+
+        for start in range(0, len(self) * self.batch_size, self.batch_size):
+            end = min(start + self.batch_size, self.num_samples)
+            if order is None:
+                yield slice(start, end)
+            else:
+                yield order[start:end]
+
+    def __len__(self):
+        if self.drop_last:
+            return self.num_samples // self.batch_size
+        return (self.num_samples + self.batch_size - 1) // self.batch_size
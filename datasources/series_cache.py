@@ -0,0 +1,309 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from enum import Enum
+from typing import Optional
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+import pandas as pd
+
+TIMESTAMPS_FILE = 'timestamps.npy'
+MAINS_FILE = 'mains.npy'
+METER_FILE = 'meter.npy'
+META_FILE = 'meta.json'
+INDEX_DIR = 'index'
+JSON_EXTENSION = '.json'
+
+
+class AlignedSeries:
+    """
+    The aligned & NaN-filled mains and meter series of a building/appliance for a date range, before any
+    normalization or windowing takes place.
+
+    Args:
+        timestamps(np.array): int64 UTC timestamps in nanoseconds
+        mains(np.array): the mains values
+        meter(np.array): the appliance meter values
+        tz(str): the timezone of the original index
+    """
+    def __init__(self, timestamps: np.array, mains: np.array, meter: np.array, tz: str = None):
+        self.timestamps = timestamps
+        self.mains = mains
+        self.meter = meter
+        self.tz = tz
+
+    def __len__(self):
+        return len(self.mains)
+
+    def slice_dates(self, start_date: str, end_date: str) -> 'AlignedSeries':
+        """
+        Returns the part of the series in [start_date, end_date), like a NILMTK window, as views of the arrays.
+        The dates without a timezone are in the timezone of the series.
+        """
+        bounds = []
+        for date in [start_date, end_date]:
+            timestamp = pd.Timestamp(date)
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.tz_localize(self.tz or 'UTC')
+            bounds.append(timestamp.value)
+        start, end = np.searchsorted(self.timestamps, bounds, side='left')
+        return AlignedSeries(self.timestamps[start:end], self.mains[start:end], self.meter[start:end], self.tz)
+
+
+def share_series(series: AlignedSeries) -> dict:
+    """
+    Copies the arrays of the series in shared memory blocks and returns a small picklable handle, so that a worker
+    process can pass the series to its parent without pickling the arrays. The blocks are released by receive_series,
+    or by release_series if the series are not needed anymore.
+    """
+    handle = {'tz': series.tz, 'arrays': {}}
+    try:
+        for name in ['timestamps', 'mains', 'meter']:
+            array = np.ascontiguousarray(getattr(series, name))
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            handle['arrays'][name] = (block.name, array.dtype.str, array.shape)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+            block.close()
+            # the block is owned (and unlinked) by the receiving process from now on
+            resource_tracker.unregister(block._name, 'shared_memory')
+    except BaseException:
+        release_series(handle)
+        raise
+    return handle
+
+
+def receive_series(handle: dict) -> AlignedSeries:
+    arrays = {}
+    try:
+        for name, (block_name, dtype, shape) in handle['arrays'].items():
+            block = shared_memory.SharedMemory(name=block_name)
+            try:
+                arrays[name] = np.array(np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf))
+            finally:
+                block.close()
+                block.unlink()
+    except BaseException:
+        release_series(handle)
+        raise
+    return AlignedSeries(arrays['timestamps'], arrays['mains'], arrays['meter'], handle['tz'])
+
+
+def release_series(handle: dict):
+    """
+    Unlinks the shared memory blocks of a handle of share_series. The blocks that are already gone are skipped.
+    """
+    for block_name, _, _ in handle['arrays'].values():
+        try:
+            block = shared_memory.SharedMemory(name=block_name)
+        except FileNotFoundError:
+            continue
+        block.close()
+        block.unlink()
+
+
+class SeriesCache:
+    """
+    A content-addressed on-disk cache of AlignedSeries. Every entry is a directory named after the hash of the
+    experiment configuration (datasource, building, appliance, dates, sample_period, fillna_method), which holds one
+    .npy file per series and a small json with the description of the entry and the fingerprint of the source file.
+    Entries are opened as memory-mapped arrays, so a cache hit costs only a few milliseconds. An entry is invalidated
+    when the size or the modification time of the source HDF5 file changes.
+    Next to the series, the cache keeps a metadata index with small json entries (e.g. the aligned length of a
+    building/appliance/dates/sample_period), which can be looked up without reading the series at all.
+
+    Args:
+        cache_dir(str): the directory of the cache, it is created if it doesn't exist.
+
+    Example of use:
+        cache = SeriesCache('output/cache')
+        description = SeriesCache.describe('UKDALE', 1, 'kettle', ['2013-04-12', '2014-12-15'], 6, FILL_ZEROS)
+        key = SeriesCache.make_key(description)
+        series = cache.get(key, source_path=UK_DALE)
+        if series is None:
+            series = read_the_series()
+            cache.put(key, series, source_path=UK_DALE, description=description)
+    """
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(os.path.join(self.cache_dir, INDEX_DIR), exist_ok=True)
+
+    @staticmethod
+    def describe(datasource_name: str, building: int, appliance: str, dates: list, sample_period: int,
+                 fillna_method=None) -> dict:
+        if isinstance(fillna_method, Enum):
+            fillna_method = fillna_method.value
+        return {'datasource': datasource_name,
+                'building': int(building),
+                'appliance': appliance,
+                'dates': [str(date) for date in dates],
+                'sample_period': sample_period,
+                'fillna_method': fillna_method}
+
+    @staticmethod
+    def make_key(description: dict) -> str:
+        return hashlib.sha1(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def fingerprint(source_path: str = None) -> Optional[dict]:
+        if source_path and os.path.exists(source_path):
+            stat = os.stat(source_path)
+            return {'path': os.path.abspath(source_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        return None
+
+    def get_entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def read_meta(self, key: str) -> Optional[dict]:
+        meta_path = os.path.join(self.get_entry_path(key), META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r') as meta_file:
+            return json.load(meta_file)
+
+    def is_valid(self, key: str, source_path: str = None) -> bool:
+        meta = self.read_meta(key)
+        if meta is None:
+            return False
+        fingerprint = self.fingerprint(source_path)
+        return fingerprint is None or meta.get('source') == fingerprint
+
+    def get_length(self, key: str, source_path: str = None) -> Optional[int]:
+        if not self.is_valid(key, source_path):
+            return None
+        return self.read_meta(key).get('length')
+
+    def get(self, key: str, source_path: str = None) -> Optional[AlignedSeries]:
+        if not self.is_valid(key, source_path):
+            self.invalidate(key)
+            return None
+        entry_path = self.get_entry_path(key)
+        meta = self.read_meta(key)
+        return AlignedSeries(timestamps=np.load(os.path.join(entry_path, TIMESTAMPS_FILE), mmap_mode='r'),
+                             mains=np.load(os.path.join(entry_path, MAINS_FILE), mmap_mode='r'),
+                             meter=np.load(os.path.join(entry_path, METER_FILE), mmap_mode='r'),
+                             tz=meta.get('tz'))
+
+    def put(self, key: str, series: AlignedSeries, source_path: str = None, description: dict = None):
+        """
+        Writes the entry in a temporary directory first and then moves it in place, so that concurrent readers never
+        see a partially written entry. A valid entry is kept as it is, since the key already determines its series.
+        """
+        if self.is_valid(key, source_path):
+            return
+        meta = {'description': description,
+                'source': self.fingerprint(source_path),
+                'tz': series.tz,
+                'length': len(series)}
+        tmp_path = tempfile.mkdtemp(dir=self.cache_dir)
+        np.save(os.path.join(tmp_path, TIMESTAMPS_FILE), np.asarray(series.timestamps))
+        np.save(os.path.join(tmp_path, MAINS_FILE), np.asarray(series.mains))
+        np.save(os.path.join(tmp_path, METER_FILE), np.asarray(series.meter))
+        with open(os.path.join(tmp_path, META_FILE), 'w') as meta_file:
+            json.dump(meta, meta_file)
+        self.invalidate(key)
+        try:
+            os.rename(tmp_path, self.get_entry_path(key))
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def invalidate(self, key: str):
+        entry_path = self.get_entry_path(key)
+        if os.path.exists(entry_path):
+            shutil.rmtree(entry_path, ignore_errors=True)
+
+    def get_index_entry(self, key: str, source_path: str = None) -> Optional[dict]:
+        index_path = os.path.join(self.cache_dir, INDEX_DIR, key + JSON_EXTENSION)
+        if not os.path.exists(index_path):
+            return None
+        with open(index_path, 'r') as index_file:
+            entry = json.load(index_file)
+        fingerprint = self.fingerprint(source_path)
+        if fingerprint is not None and entry.get('source') != fingerprint:
+            return None
+        return entry
+
+    def put_index_entry(self, key: str, values: dict, source_path: str = None, description: dict = None):
+        """
+        Updates the index entry of the given key with the given values. An outdated entry is replaced.
+        """
+        entry = self.get_index_entry(key, source_path) or {'description': description,
+                                                           'source': self.fingerprint(source_path)}
+        entry.update(values)
+        file_descriptor, tmp_path = tempfile.mkstemp(dir=os.path.join(self.cache_dir, INDEX_DIR))
+        with os.fdopen(file_descriptor, 'w') as index_file:
+            json.dump(entry, index_file)
+        os.replace(tmp_path, os.path.join(self.cache_dir, INDEX_DIR, key + JSON_EXTENSION))
+
+
+class SeriesMemo:
+    """
+    An in-memory layer over an optional SeriesCache, with the same interface, that keeps the AlignedSeries and the
+    index entries which were read during its lifetime. It is meant to live as long as the work that shares the same
+    series, e.g. all the models and iterations of an experiment device, so that the series are loaded once and every
+    model only builds its own windows on them. Then, it is cleared and the memory is released.
+
+    Args:
+        cache(SeriesCache): the on-disk cache behind the memo. If it's None, the series are kept only in memory.
+            Default: None
+
+    Example of use:
+        memo = SeriesMemo(cache)
+        for model_name in models:
+            train_dataset = ElectricityDataset(..., cache=memo)
+        memo.clear()
+    """
+    def __init__(self, cache: SeriesCache = None):
+        self.cache = cache
+        self.cache_dir = cache.cache_dir if cache is not None else None
+        self.series = {}
+        self.index = {}
+
+    def is_valid(self, key: str, source_path: str = None) -> bool:
+        return key in self.series or (self.cache is not None and self.cache.is_valid(key, source_path))
+
+    def get_length(self, key: str, source_path: str = None) -> Optional[int]:
+        if key in self.series:
+            return len(self.series[key])
+        return self.cache.get_length(key, source_path) if self.cache is not None else None
+
+    def get(self, key: str, source_path: str = None) -> Optional[AlignedSeries]:
+        if key not in self.series and self.cache is not None:
+            series = self.cache.get(key, source_path)
+            if series is not None:
+                self.series[key] = series
+        return self.series.get(key)
+
+    def put(self, key: str, series: AlignedSeries, source_path: str = None, description: dict = None,
+            persist: bool = True):
+        """
+        If persist is False, the series is kept only in memory, e.g. when it is a slice of a series that is already
+        cached.
+        """
+        self.series[key] = series
+        if persist and self.cache is not None:
+            self.cache.put(key, series, source_path=source_path, description=description)
+
+    def invalidate(self, key: str):
+        self.series.pop(key, None)
+        self.index.pop(key, None)
+        if self.cache is not None:
+            self.cache.invalidate(key)
+
+    def get_index_entry(self, key: str, source_path: str = None) -> Optional[dict]:
+        if key not in self.index and self.cache is not None:
+            entry = self.cache.get_index_entry(key, source_path)
+            if entry is not None:
+                self.index[key] = entry
+        return self.index.get(key)
+
+    def put_index_entry(self, key: str, values: dict, source_path: str = None, description: dict = None):
+        self.index.setdefault(key, {'description': description}).update(values)
+        if self.cache is not None:
+            self.cache.put_index_entry(key, values, source_path=source_path, description=description)
+
+    def clear(self):
+        self.series = {}
+        self.index = {}
@@ -1,9 +1,16 @@
+import os
+import math
+import bisect
 import torch
 from abc import ABC
+from enum import Enum
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from typing import Iterator
-from collections import deque
 from torch.utils.data.dataset import T_co
-from datasources.datasource import Datasource
+from datasources.datasource import Datasource, DatasourceFactory
+from datasources.series_cache import SeriesCache, AlignedSeries, share_series, receive_series, release_series
+from datasources.chunk_reader import PrefetchingChunkReader
+from datasources.running_stats import RunningStats
 from torch.utils.data import Dataset, IterableDataset
 from datasources.preprocessing_lib import *
 from lab.training_tools import ON_THRESHOLDS
@@ -11,6 +18,64 @@ from constants.constants import *
 from constants.enumerates import *
 
 
+def load_aligned_series(datasource: Datasource, building: int, device: str, start_date: str, end_date: str,
+                        sample_period: int, chunksize: int, fillna_method: SupportedFillingMethods,
+                        cache: SeriesCache = None) -> AlignedSeries:
+    """
+    Returns the aligned & NaN-filled series of the given building and device. When a cache is given, the series
+    are read from there and the NILMTK generators are only used on a cache miss, after which the cache is filled.
+    """
+    if cache is None:
+        return read_aligned_series(datasource, building, device, start_date, end_date, sample_period, chunksize,
+                                   fillna_method)
+
+    description = SeriesCache.describe(datasource.get_name(), building, device, [start_date, end_date],
+                                       sample_period, fillna_method)
+    key = SeriesCache.make_key(description)
+    series = cache.get(key, source_path=datasource.get_path())
+    if series is None:
+        series = read_aligned_series(datasource, building, device, start_date, end_date, sample_period, chunksize,
+                                     fillna_method)
+        if len(series):
+            cache.put(key, series, source_path=datasource.get_path(), description=description)
+    return series
+
+
+def read_aligned_series(datasource: Datasource, building: int, device: str, start_date: str, end_date: str,
+                        sample_period: int, chunksize: int, fillna_method: SupportedFillingMethods) -> AlignedSeries:
+    chunk_reader = BaseElectricityDataset._create_chunk_reader(datasource, building, device, start_date, end_date,
+                                                               sample_period, chunksize)
+    timestamps, mains, meter, tz = [], [], [], None
+    for mainchunk, meterchunk in chunk_reader:
+        mainchunk, meterchunk = align_chunks(mainchunk, meterchunk)
+        if not len(mainchunk) and not len(meterchunk):
+            raise Exception('you need to increase chunksize')
+        mainchunk, meterchunk = fill_nans(mainchunk, meterchunk, fillna_method)
+        timestamps.append(mainchunk.index.asi8)
+        mains.append(mainchunk.values)
+        meter.append(meterchunk.values)
+        if mainchunk.index.tz is not None:
+            tz = str(mainchunk.index.tz)
+
+    if not timestamps:
+        return AlignedSeries(np.array([], dtype=np.int64), np.array([]), np.array([]), tz)
+    return AlignedSeries(np.concatenate(timestamps), np.concatenate(mains), np.concatenate(meter), tz)
+
+
+def load_shared_aligned_series(datasource_name: str, datasource_path: str, building: int, device: str,
+                               start_date: str, end_date: str, sample_period: int, chunksize: int,
+                               fillna_method: SupportedFillingMethods, cache_dir: str = None) -> dict:
+    """
+    The entry point of the worker processes of ElectricityMultiBuildingsDataset. The datasource is re-opened in the
+    worker and the aligned series are returned through shared memory (check: datasources/series_cache).
+    """
+    datasource = DatasourceFactory.open_datasource(datasource_name, datasource_path)
+    cache = SeriesCache(cache_dir) if cache_dir else None
+    series = load_aligned_series(datasource, building, device, start_date, end_date, sample_period, chunksize,
+                                 fillna_method, cache)
+    return share_series(series)
+
+
 class BaseElectricityDataset(ABC):
     """
     -BaseElectricityDataset
@@ -64,6 +129,18 @@ class BaseElectricityDataset(ABC):
         noise_factor (float): a factor tο multiply a gaussian noise signal, which will be added to the normalized
             mains timeseries. The noise follows a gaussian distribution (mu=0, sigma=1).
             The final signal is given by : mains = mains + noise_factor * np.random(0, 1)
+        lazy_windows(bool): if True, only the 1-D aligned mains & meter series are kept in memory and the windows
+            are zero-copy strided views over them, so memory grows with the length of the series instead of
+            length x window_size. If False, every window is copied in a (N, window_size) matrix.
+            Default: True
+        cache(SeriesCache or SeriesMemo): an on-disk (or in-memory) cache of the aligned & NaN-filled series (check: datasources/series_cache).
+            If given, the NILMTK generators are used only when the requested series are not cached yet.
+            Default: None
+        window_stride(int): the stride of the windows of SEQ_T0_SEQ and SEQ_T0_SUBSEQ, e.g. for test sets, between 1
+            and the output window. A stride equal to the output window gives non-overlapping outputs, smaller strides
+            give overlapping outputs which are averaged (check: datasources/preprocessing_lib.overlap_add). The last
+            samples that don't fill a whole stride are dropped.
+            Default: 1
 
     Functionality in a nut-shell:
         After saving the input arguments as class properties, the NILMTK generators are initialized and
@@ -77,7 +154,8 @@ class BaseElectricityDataset(ABC):
                  meter_means: float = None, meter_stds: float = None, sample_period: int = None, chunksize: int = 10000,
                  shuffle: bool = False, normalization_method: str = STANDARDIZATION,
                  preprocessing_method: str = SupportedPreprocessingMethods.ROLLING_WINDOW, subseq_window: int = None,
-                 fillna_method: str = SupportedFillingMethods.FILL_ZEROS, noise_factor: float = None):
+                 fillna_method: str = SupportedFillingMethods.FILL_ZEROS, noise_factor: float = None,
+                 lazy_windows: bool = True, cache: SeriesCache = None, window_stride: int = 1):
         self.building = building
         self.device = device
         self.mmax = mmax
@@ -94,24 +172,31 @@ class BaseElectricityDataset(ABC):
         self.fillna_method = fillna_method
         self.window_size = window_size
         self.subseq_window = subseq_window
+        self.window_stride = window_stride
         self.shuffle = shuffle
+        self.permutation = None
         self.threshold = ON_THRESHOLDS.get(device, 50)
         self.normalization_method = normalization_method
         self.mainchunk = torch.tensor([])
         self.meterchunk = torch.tensor([])
+        self.mainseries = torch.tensor([])
+        self.meterseries = torch.tensor([])
         self.has_more_data = True
         self.noise_factor = noise_factor
+        self.lazy_windows = lazy_windows
+        self.cache = cache
         self._run()
 
     def _run(self):
-        self._init_generators(datasource=self.datasource,
-                              building=self.building,
-                              device=self.device,
-                              start_date=self.start_date,
-                              end_date=self.end_date,
-                              sample_period=self.sample_period,
-                              chunksize=self.chunksize)
-        self._reload()
+        series = self._load_series(datasource=self.datasource,
+                                   building=self.building,
+                                   device=self.device,
+                                   start_date=self.start_date,
+                                   end_date=self.end_date)
+        if len(series):
+            self.mainchunk, self.meterchunk = self._chunk_preprocessing(series.mains, series.meter)
+            self.permutation = self._shuffled_indices(len(self.mainchunk))
+        self.has_more_data = False
 
     def __len__(self):
         return len(self.mainchunk)
@@ -123,16 +208,43 @@ class BaseElectricityDataset(ABC):
     def _set_means_stds(self, mainchunk, meterchunk):
         if self.means is None and self.stds is None and len(mainchunk):
             self.means = mainchunk.mean()
-            self.stds = mainchunk.std()
+            self.stds = mainchunk.std(ddof=1)
 
         if self.meter_means is None and self.meter_stds is None and len(meterchunk):
             self.meter_means = meterchunk.mean()
-            self.meter_stds = meterchunk.std()
+            self.meter_stds = meterchunk.std(ddof=1)
 
     def __getitem__(self, i):
+        """
+        Besides a single index, i can be a slice or a LongTensor of indices (check: datasources/samplers), in which
+        case a whole (B, W) batch is returned with one slice/gather of the windows.
+        """
+        i = self._permute(i)
         x = self.mainchunk
         y = self.meterchunk
-        return x[i].float(), y[i].float()
+        return self._add_noise(x[i].float()), y[i].float()
+
+    def _shuffled_indices(self, length: int):
+        """
+        The windows are never shuffled themselves, since indexing the views with a permutation would copy all of them
+        in a (N, W) matrix. If shuffle is True, a permutation of the indices is kept instead and the windows are
+        gathered through it, per requested item or batch (check: _permute).
+        """
+        return torch.randperm(length) if self.shuffle else None
+
+    def _permute(self, i):
+        if self.permutation is None:
+            return i
+        return self.permutation[i]
+
+    def _add_noise(self, mainwindows: torch.Tensor) -> torch.Tensor:
+        """
+        In lazy mode the windows are views over the mains series, so the gaussian noise is drawn per requested window
+        instead of being added once to the materialized windows.
+        """
+        if self.noise_factor and self.lazy_windows:
+            return mainwindows + self.noise_factor * torch.randn_like(mainwindows)
+        return mainwindows
 
     def __mmax__(self):
         return self.mmax
@@ -140,38 +252,64 @@ class BaseElectricityDataset(ABC):
     def _init_generators(self, datasource: Datasource, building: int, device: str, start_date: str,
                          end_date: str, sample_period: int, chunksize: int):
         self.datasource = datasource
-        self.mains_generator = self.datasource.get_mains_generator(start=start_date,
-                                                                   end=end_date,
-                                                                   sample_period=sample_period,
-                                                                   building=building,
-                                                                   chunksize=chunksize)
-
-        self.appliance_generator = self.datasource.get_appliance_generator(appliance=device,
-                                                                           start=start_date,
-                                                                           end=end_date,
-                                                                           sample_period=sample_period,
-                                                                           building=building,
-                                                                           chunksize=chunksize)
+        if getattr(self, 'chunk_reader', None) is not None:
+            self.chunk_reader.close()
+        self.chunk_reader = self._create_chunk_reader(datasource, building, device, start_date, end_date,
+                                                      sample_period, chunksize)
+
+    @staticmethod
+    def _create_chunk_reader(datasource: Datasource, building: int, device: str, start_date: str,
+                             end_date: str, sample_period: int, chunksize: int) -> PrefetchingChunkReader:
+        """
+        The chunks are read in advance by a background thread (check: datasources/chunk_reader), while the current
+        chunk is aligned and preprocessed.
+        """
+        mains_generator, appliance_generator = BaseElectricityDataset._create_generators(datasource, building, device,
+                                                                                         start_date, end_date,
+                                                                                         sample_period, chunksize)
+        return PrefetchingChunkReader(mains_generator, appliance_generator,
+                                      concurrent=getattr(datasource, 'thread_safe', False))
+
+    @staticmethod
+    def _create_generators(datasource: Datasource, building: int, device: str, start_date: str,
+                           end_date: str, sample_period: int, chunksize: int):
+        mains_generator = datasource.get_mains_generator(start=start_date,
+                                                         end=end_date,
+                                                         sample_period=sample_period,
+                                                         building=building,
+                                                         chunksize=chunksize)
+
+        appliance_generator = datasource.get_appliance_generator(appliance=device,
+                                                                 start=start_date,
+                                                                 end=end_date,
+                                                                 sample_period=sample_period,
+                                                                 building=building,
+                                                                 chunksize=chunksize)
+        return mains_generator, appliance_generator
 
     def _reload(self):
         try:
-            mainchunk = next(self.mains_generator)
-            meterchunk = next(self.appliance_generator)
+            mainchunk, meterchunk = next(self.chunk_reader)
             mainchunk, meterchunk = align_chunks(mainchunk, meterchunk)
             if len(mainchunk) or len(meterchunk):
-                mainchunk, meterchunk = self._chunk_preprocessing(mainchunk, meterchunk)
-                self.mainchunk, self.meterchunk = torch.from_numpy(np.array(mainchunk)), torch.from_numpy(
-                    np.array(meterchunk))
+                mainchunk, meterchunk = self._fill_nans(mainchunk, meterchunk)
+                self.mainchunk, self.meterchunk = self._chunk_preprocessing(mainchunk.values, meterchunk.values)
             else:
                 raise Exception('you need to increase chunksize')
         except StopIteration:
             self.has_more_data = False
             return
 
-    def _chunk_preprocessing(self, mainchunk, meterchunk):
-        if self.fillna_method == SupportedFillingMethods.FILL_INTERPOLATION:
-            mainchunk, meterchunk = replace_nans_interpolation(mainchunk, meterchunk)
-        mainchunk, meterchunk = replace_nans(mainchunk, meterchunk)
+    def _load_series(self, datasource: Datasource, building: int, device: str, start_date: str,
+                     end_date: str) -> AlignedSeries:
+        self.datasource = datasource
+        return load_aligned_series(datasource, building, device, start_date, end_date, self.sample_period,
+                                   self.chunksize, self.fillna_method, self.cache)
+
+    def _fill_nans(self, mainchunk, meterchunk):
+        return fill_nans(mainchunk, meterchunk, self.fillna_method)
+
+    def _chunk_preprocessing(self, mainchunk: np.array, meterchunk: np.array):
         if self.normalization_method == STANDARDIZATION:
             if None in [self.means, self.meter_means, self.meter_stds, self.stds]:
                 self._set_means_stds(mainchunk, meterchunk)
@@ -180,22 +318,60 @@ class BaseElectricityDataset(ABC):
             self._set_mmax(mainchunk)
             mainchunk, meterchunk = normalize_chunks(mainchunk, meterchunk, self.mmax)
 
+        self.mainseries = torch.from_numpy(np.array(mainchunk))
+        self.meterseries = torch.from_numpy(np.array(meterchunk))
+        if self.lazy_windows:
+            mainchunk, meterchunk = self._window_views(self.mainseries, self.meterseries)
+        else:
+            mainchunk, meterchunk = self._apply_windows(self.mainseries.numpy(), self.meterseries.numpy())
+        return mainchunk, meterchunk
+
+    def _count_windows(self, length: int) -> int:
+        """
+        The number of windows that _chunk_preprocessing cuts from a series of the given length.
+        """
+        if self.preprocessing_method in [SupportedPreprocessingMethods.ROLLING_WINDOW,
+                                         SupportedPreprocessingMethods.MIDPOINT_WINDOW]:
+            stride = 1
+        elif self.preprocessing_method in [SupportedPreprocessingMethods.SEQ_T0_SEQ,
+                                           SupportedPreprocessingMethods.SEQ_T0_SUBSEQ]:
+            stride = self.window_stride
+        else:
+            return length
+        if length < self.window_size:
+            return 0
+        return (length - self.window_size) // stride + 1
+
+    def _window_views(self, mainseries: torch.Tensor, meterseries: torch.Tensor):
+        if self.preprocessing_method == SupportedPreprocessingMethods.ROLLING_WINDOW:
+            return rolling_window_view(mainseries, meterseries, self.window_size)
+        elif self.preprocessing_method == SupportedPreprocessingMethods.MIDPOINT_WINDOW:
+            return midpoint_window_view(mainseries, meterseries, self.window_size)
+        elif self.preprocessing_method == SupportedPreprocessingMethods.SEQ_T0_SEQ:
+            return sequence_to_sequence_view(mainseries, meterseries, self.window_size, stride=self.window_stride)
+        elif self.preprocessing_method == SupportedPreprocessingMethods.SEQ_T0_SUBSEQ:
+            return sequence_to_subsequence_view(mainseries, meterseries,
+                                                sequence_window=self.window_size,
+                                                subsequence_window=self.subseq_window,
+                                                stride=self.window_stride)
+        return mainseries, meterseries
+
+    def _apply_windows(self, mainchunk, meterchunk):
         if self.preprocessing_method == SupportedPreprocessingMethods.ROLLING_WINDOW:
             mainchunk, meterchunk = apply_rolling_window(mainchunk, meterchunk, self.window_size)
         elif self.preprocessing_method == SupportedPreprocessingMethods.MIDPOINT_WINDOW:
             mainchunk, meterchunk = apply_midpoint_window(mainchunk, meterchunk, self.window_size)
         elif self.preprocessing_method == SupportedPreprocessingMethods.SEQ_T0_SEQ:
-            mainchunk, meterchunk = apply_sequence_to_sequence(mainchunk, meterchunk, self.window_size)
+            mainchunk, meterchunk = apply_sequence_to_sequence(mainchunk, meterchunk, self.window_size,
+                                                               stride=self.window_stride)
         elif self.preprocessing_method == SupportedPreprocessingMethods.SEQ_T0_SUBSEQ:
             mainchunk, meterchunk = apply_sequence_to_subsequence(mainchunk, meterchunk,
                                                                   sequence_window=self.window_size,
-                                                                  subsequence_window=self.subseq_window)
+                                                                  subsequence_window=self.subseq_window,
+                                                                  stride=self.window_stride)
         if self.noise_factor:
             mainchunk = add_gaussian_noise(mainchunk, self.noise_factor)
-
-        if self.shuffle:
-            mainchunk, meterchunk = mainchunk.sample(frac=1), meterchunk.sample(frac=1)
-        return mainchunk, meterchunk
+        return torch.from_numpy(np.array(mainchunk)), torch.from_numpy(np.array(meterchunk))
 
     def _standardize_chunks(self, mainchunk, meterchunk):
         ######
@@ -262,6 +438,18 @@ class ElectricityDataset(BaseElectricityDataset, Dataset):
         noise_factor (float): a factor tο multiply a gaussian noise signal, which will be added to the normalized
             mains timeseries. The noise follows a gaussian distribution (mu=0, sigma=1).
             The final signal is given by : mains = mains + noise_factor * np.random(0, 1)
+        lazy_windows(bool): if True, only the 1-D aligned mains & meter series are kept in memory and the windows
+            are zero-copy strided views over them, so memory grows with the length of the series instead of
+            length x window_size. If False, every window is copied in a (N, window_size) matrix.
+            Default: True
+        cache(SeriesCache or SeriesMemo): an on-disk (or in-memory) cache of the aligned & NaN-filled series (check: datasources/series_cache).
+            If given, the NILMTK generators are used only when the requested series are not cached yet.
+            Default: None
+        window_stride(int): the stride of the windows of SEQ_T0_SEQ and SEQ_T0_SUBSEQ, e.g. for test sets, between 1
+            and the output window. A stride equal to the output window gives non-overlapping outputs, smaller strides
+            give overlapping outputs which are averaged (check: datasources/preprocessing_lib.overlap_add). The last
+            samples that don't fill a whole stride are dropped.
+            Default: 1
 
     Functionality in a nut-shell:
         After saving the input arguments as class properties, the NILMTK generators are initialized and
@@ -290,13 +478,15 @@ class ElectricityDataset(BaseElectricityDataset, Dataset):
                  stds: float = None, meter_means: float = None, meter_stds: float = None, sample_period: int = None,
                  normalization_method: str = STANDARDIZATION, noise_factor: float = None,
                  preprocessing_method: str = SupportedPreprocessingMethods.ROLLING_WINDOW, subseq_window: int = None,
-                 fillna_method: str = SupportedFillingMethods.FILL_ZEROS,):
+                 fillna_method: str = SupportedFillingMethods.FILL_ZEROS, lazy_windows: bool = True,
+                 cache: SeriesCache = None, window_stride: int = 1,):
         super().__init__(datasource, building, device,
                          dates[0], dates[1], window_size,
                          mmax, means, stds, meter_means, meter_stds,
                          sample_period, chunksize, normalization_method=normalization_method,
                          preprocessing_method=preprocessing_method, subseq_window=subseq_window,
-                         fillna_method=fillna_method, noise_factor=noise_factor,)
+                         fillna_method=fillna_method, noise_factor=noise_factor, lazy_windows=lazy_windows,
+                         cache=cache, window_stride=window_stride,)
 
 
 class ElectricityMultiBuildingsDataset(BaseElectricityDataset, Dataset):
@@ -347,17 +537,24 @@ class ElectricityMultiBuildingsDataset(BaseElectricityDataset, Dataset):
         noise_factor (float): a factor tο multiply a gaussian noise signal, which will be added to the normalized
             mains timeseries. The noise follows a gaussian distribution (mu=0, sigma=1).
             The final signal is given by : mains = mains + noise_factor * np.random(0, 1)
+        parallel_loading(bool): whether the buildings should be loaded concurrently by a process pool or not
+            Default: True
+        cache(SeriesCache or SeriesMemo): an on-disk (or in-memory) cache of the aligned & NaN-filled series (check: datasources/series_cache).
+            Default: None
 
     Functionality in a nut-shell:
-        After saving the input arguments as class properties, the NILMTK generators are initialized and
-        all the data are loaded in the memory. Due to the fact that the data should be loaded from multiple
-        datasources, two lists are instantiated containing the corresponding data generators. Thus, the reloading
-        of the data is different in comparison to the ElectricityDataset. The class attribute self.mains_generators
-        is a list that contains all the generators needed for the multi-building training. In method _run, this list
-        is initialized to have length equal to the number of buildings. Hence, the length of the list is the same as
-        the number of buildings-generators specified in the train_info of the experiment. The method _init_generators
-        fills each position of the self.mains_generators list with the specific building generator by calling the method
-         _init_single_building_generators. Essentially, the _init_generators is a loop.
+        After saving the input arguments as class properties, the data of every building are loaded in the memory.
+        Due to the fact that the data should be loaded from multiple datasources, the class attribute self.datasources
+        is a list that contains all the datasources needed for the multi-building training. In method _run, this list
+        is initialized to have length equal to the number of buildings specified in the train_info of the experiment.
+        The method _init_generators fills each position of the self.datasources list and loads the series of the
+        specific building by calling the method _load_single_building. Essentially, the _init_generators is a loop.
+        If parallel_loading is True, the buildings that are not cached are loaded concurrently by a pool of worker
+        processes, which return the aligned series through shared memory, and are then preprocessed in order.
+        The windows of every building are kept as a separate segment in the lists self.mainchunks & self.meterchunks
+        and a cumulative offset index maps the dataset indices to the segments. Thus, every building is written
+        in memory once, without re-allocating the data of the previous buildings, and no window crosses the boundary
+        between two buildings.
 
         Then, the mains & target meter time series are aligned before preprocessing takes place. The preprocessing
         consists of time series normalization/standardization (depends on the chosen normalization method) and the
@@ -382,8 +579,10 @@ class ElectricityMultiBuildingsDataset(BaseElectricityDataset, Dataset):
     """
     def __init__(self, train_info: list = None, window_size: int = 50, chunksize: int = 10 ** 10, mmax: float = None,
                  means: float = None, stds: float = None, meter_means: float = None, meter_stds: float = None,
-                 sample_period: int = None, normalization_method=STANDARDIZATION, **load_kwargs):
+                 sample_period: int = None, normalization_method=STANDARDIZATION, parallel_loading: bool = True,
+                 **load_kwargs):
         self.train_info = train_info
+        self.parallel_loading = parallel_loading
         super().__init__(datasource=None, building=0, device='', start_date='', end_date='',
                          window_size=window_size, mmax=mmax, means=means, stds=stds, meter_means=meter_means,
                          meter_stds=meter_stds, sample_period=sample_period, chunksize=chunksize,
@@ -391,54 +590,129 @@ class ElectricityMultiBuildingsDataset(BaseElectricityDataset, Dataset):
 
     def _run(self):
         num_buildings = len(self.train_info)
-        self.mains_generators = [None] * num_buildings
-        self.appliance_generators = [None] * num_buildings
         self.datasources = [None] * num_buildings
+        self.mainchunks = [self.mainchunk] * num_buildings
+        self.meterchunks = [self.meterchunk] * num_buildings
         self._init_generators(self.train_info, self.sample_period, self.chunksize)
+        self._set_segment_offsets()
+        self.permutation = self._shuffled_indices(len(self))
 
     def _init_generators(self, train_info, sample_period, chunksize, **kwargs):
+        buildings = []
         for (index, element) in enumerate(train_info):
             datasource = element['datasource']
             building = element['building']
             device = element['device']
             start_date = element['dates'][0]
             end_date = element['dates'][1]
-            self._init_single_building_generators(datasource, building, device, start_date,
-                                                  end_date, sample_period, chunksize, index)
-
-    def _init_single_building_generators(self, datasource: Datasource, building, device, start_date,
-                                         end_date, sample_period, chunksize, index):
-        self.datasources[index] = datasource
-        self.mains_generators[index] = self.datasources[index].get_mains_generator(start=start_date,
-                                                                                   end=end_date,
-                                                                                   sample_period=sample_period,
-                                                                                   building=building,
-                                                                                   chunksize=chunksize)
-
-        self.appliance_generators[index] = self.datasources[index].get_appliance_generator(appliance=device,
-                                                                                           start=start_date,
-                                                                                           end=end_date,
-                                                                                           sample_period=sample_period,
-                                                                                           building=building,
-                                                                                           chunksize=chunksize)
-        self.mains_generator, self.appliance_generator = self.mains_generators[index], self.appliance_generators[index]
-        self._reload()
+            self.datasources[index] = datasource
+            buildings.append((datasource, building, device, start_date, end_date))
 
-    def _reload(self):
+        parallel_indices = self._get_parallel_indices(buildings)
+        executor = ProcessPoolExecutor(max_workers=min(len(parallel_indices), os.cpu_count())) \
+            if parallel_indices else None
+        futures, received = {}, set()
         try:
-            mainchunk = next(self.mains_generator)
-            meterchunk = next(self.appliance_generator)
-            mainchunk, meterchunk = align_chunks(mainchunk, meterchunk)
-            if len(mainchunk) or len(meterchunk):
-                mainchunk, meterchunk = self._chunk_preprocessing(mainchunk, meterchunk)
-                mainchunk = torch.from_numpy(np.array(mainchunk))
-                meterchunk = torch.from_numpy(np.array(meterchunk))
-                self.mainchunk = torch.cat((self.mainchunk, mainchunk), 0)
-                self.meterchunk = torch.cat((self.meterchunk, meterchunk), 0)
-            else:
-                raise Exception(' you need to increase chunksize')
-        except StopIteration:
-            return
+            for index in parallel_indices:
+                futures[index] = executor.submit(load_shared_aligned_series, buildings[index][0].get_name(),
+                                                 buildings[index][0].get_path(), *buildings[index][1:],
+                                                 sample_period=sample_period, chunksize=chunksize,
+                                                 fillna_method=self.fillna_method,
+                                                 cache_dir=self.cache.cache_dir if self.cache else None)
+            for (index, building) in enumerate(buildings):
+                if index in futures:
+                    self.datasource = building[0]
+                    received.add(index)
+                    series = receive_series(futures[index].result())
+                    if self.cache is not None and len(series):
+                        self._put_series(series, *building)
+                else:
+                    series = self._load_series(*building)
+                self._load_single_building(series, index)
+        finally:
+            if executor is not None:
+                self._release_pending_series(executor, futures, received)
+
+    @staticmethod
+    def _release_pending_series(executor: ProcessPoolExecutor, futures: dict, received: set):
+        """
+        If the loading fails (e.g. a worker raises), the series that were shared by the rest of the workers are never
+        received. Thus, the workers that haven't started are cancelled, the running ones are waited for and the shared
+        memory blocks of every series that was not received are unlinked.
+        """
+        for future in futures.values():
+            future.cancel()
+        executor.shutdown()
+        for index, future in futures.items():
+            if index not in received and not future.cancelled() and future.exception() is None:
+                release_series(future.result())
+
+    def _put_series(self, series: AlignedSeries, datasource: Datasource, building: int, device: str,
+                    start_date: str, end_date: str):
+        description = SeriesCache.describe(datasource.get_name(), building, device, [start_date, end_date],
+                                           self.sample_period, self.fillna_method)
+        self.cache.put(SeriesCache.make_key(description), series, source_path=datasource.get_path(),
+                       description=description)
+
+    def _get_parallel_indices(self, buildings: list) -> list:
+        """
+        The buildings that are loaded by a pool of worker processes. These are the buildings that are not cached yet
+        and whose datasource can be re-opened from its HDF5 file, when more than one building has to be loaded.
+        """
+        if not self.parallel_loading:
+            return []
+        indices = []
+        for (index, (datasource, building, device, start_date, end_date)) in enumerate(buildings):
+            if datasource.get_path() is None:
+                continue
+            if self.cache is not None:
+                description = SeriesCache.describe(datasource.get_name(), building, device, [start_date, end_date],
+                                                   self.sample_period, self.fillna_method)
+                if self.cache.is_valid(SeriesCache.make_key(description), datasource.get_path()):
+                    continue
+            indices.append(index)
+        return indices if len(indices) > 1 else []
+
+    def _load_single_building(self, series: AlignedSeries, index: int):
+        """
+        The buildings are preprocessed in the order of train_info, so the normalization parameters are always
+        calculated on the first building, no matter which worker finished first.
+        """
+        if len(series):
+            self.mainchunks[index], self.meterchunks[index] = self._chunk_preprocessing(series.mains, series.meter)
+
+    def _set_segment_offsets(self):
+        lengths = torch.tensor([len(mainchunk) for mainchunk in self.mainchunks], dtype=torch.long)
+        self.segment_ends = torch.cumsum(lengths, 0)
+        self.segment_starts = self.segment_ends - lengths
+
+    def __len__(self):
+        return int(self.segment_ends[-1]) if len(self.segment_ends) else 0
+
+    def __getitem__(self, i):
+        """
+        If shuffle is True, the indices are permuted over all the buildings before they are mapped to the segments.
+        """
+        if isinstance(i, slice):
+            i = torch.arange(len(self))[i]
+        i = self._permute(i)
+        if not isinstance(i, torch.Tensor) or not i.dim():
+            segment = bisect.bisect_right(self.segment_ends.tolist(), int(i))
+            i = int(i) - int(self.segment_starts[segment])
+            return self._add_noise(self.mainchunks[segment][i].float()), self.meterchunks[segment][i].float()
+
+        segments = torch.searchsorted(self.segment_ends, i, right=True)
+        x, y = None, None
+        for segment in torch.unique(segments).tolist():
+            mask = segments == segment
+            positions = i[mask] - self.segment_starts[segment]
+            mainwindows = self.mainchunks[segment][positions].float()
+            meterwindows = self.meterchunks[segment][positions].float()
+            if x is None:
+                x = mainwindows.new_empty((len(i),) + mainwindows.shape[1:])
+                y = meterwindows.new_empty((len(i),) + meterwindows.shape[1:])
+            x[mask], y[mask] = mainwindows, meterwindows
+        return self._add_noise(x), y
 
 
 class ElectricityIterableDataset(BaseElectricityDataset, IterableDataset):
@@ -453,10 +727,15 @@ class ElectricityIterableDataset(BaseElectricityDataset, IterableDataset):
     https://pytorch.org/docs/stable/data.html#iterable-style-datasets.
     In order for iterable datasets to work smoothly with pytorch dataloaders, the length of the dataset must be
     known a priory. Due to the lack of guidelines in the pytorch documentation about this matter, we decided to
-    create the method _calc_data_len() to specify the number of points of the dataset. This method loads and aligns
-    the data in the same manner as the method _reload, without the preprocessing. Hence, the actual length of the
-    iterable dataset is calculated. After this process is finished, the data generators have to be re-initialized.
-    Thus, _init_generators is re-called. Yet, this not an optimal solution, but it works for the time being.
+    create the method _calc_data_len() to specify the number of windows of the dataset, i.e. the windows that are cut
+    from every chunk, which lose the last window_size - 1 points of the chunk (check: _count_windows). If a cache is
+    given, the length is looked up in its metadata index (check: datasources/series_cache). Only when the length is
+    unknown, the data are loaded and aligned in the same manner as the method _reload, without the preprocessing, and
+    the length is persisted in the index, so that this extra pass over the data takes place only once.
+    With more than one dataloader worker, every worker drops the remainder of its partition of a chunk and yields its
+    own last incomplete batch, so the length is an approximation of the number of batches in that case.
+    The same pass accumulates the statistics of the whole date range (check: datasources/running_stats), so the
+    normalization parameters don't depend on whichever chunk happens to be loaded first.
 
     In the current version, NILMTK supported datasets were used
     https://arxiv.org/abs/1404.3878. Thus, the part of loading the data depends on NILMTK package.
@@ -490,7 +769,8 @@ class ElectricityIterableDataset(BaseElectricityDataset, IterableDataset):
             if STANDARDIZATION is given, the time series are standardized with mean & std values
                 of the mains & target meter time series
             if NORMALIZATION is given, the time series are normalized with the max value of the mains time series
-        batch_size(int): the batch size needed for the series iterator to work
+        batch_size(int): the size of the batches that the series iterator yields, so the dataloader has to be created
+            with batch_size=None. The length of the dataset is the number of these batches.
             Default: 32
         preprocessing_method(str): the preprocessing_method method of the time series
             possible values: ROLLING_WINDOW or MIDPOINT_WINDOW or SEQ_T0_SEQ or SEQ_T0_SUBSEQ
@@ -510,13 +790,22 @@ class ElectricityIterableDataset(BaseElectricityDataset, IterableDataset):
         noise_factor (float): a factor tο multiply a gaussian noise signal, which will be added to the normalized
             mains timeseries. The noise follows a gaussian distribution (mu=0, sigma=1).
             The final signal is given by : mains = mains + noise_factor * np.random(0, 1)
+        lazy_windows(bool): if True, only the 1-D aligned mains & meter series are kept in memory and the windows
+            are zero-copy strided views over them, so memory grows with the length of the series instead of
+            length x window_size. If False, every window is copied in a (N, window_size) matrix.
+            Default: True
+        cache(SeriesCache): the cache whose metadata index holds the length of the dataset
+            (check: datasources/series_cache).
+            Default: None
 
     Functionality in a nut-shell:
-        After saving the input arguments as class properties, the NILMTK generators are initialized for the
-        first time and the length of the dataset is calculated. Then, the generators are re-initialized and
-        the first chunk of data is loaded in the memory. The reload and preprocessing methods are the same
-        as the ElectricityDataset. Through the method 'series_iterator', the data keeps reloading until the
-        generators are exhausted.
+        After saving the input arguments as class properties, the length of the dataset is looked up in the cache or,
+        if it's unknown, calculated with a first pass of the NILMTK generators. Then, every time the dataset is iterated
+        (i.e. in every worker of the dataloader), the generators are initialized and the first chunk of data is loaded
+        in the memory. The reload and preprocessing methods are the same
+        as the ElectricityDataset. Through the method 'series_iterator', whole batches are sliced from the current
+        chunk, while the next chunk is loaded in a background thread, until the generators are exhausted. The raw
+        chunks themselves are read ahead of time by a PrefetchingChunkReader (check: datasources/chunk_reader).
 
     Example of use:
         train_dataset = ElectricityIterableDataset(datasource=datasource,
@@ -525,9 +814,9 @@ class ElectricityIterableDataset(BaseElectricityDataset, IterableDataset):
                                                    device=device,
                                                    dates=train_dates,
                                                    sample_period=SAMPLE_PERIOD,
+                                                   batch_size=BATCH,
                                                   )
-        train_loader = DataLoader(train_dataset, batch_size=BATCH,
-                                  shuffle=True, num_workers=8)
+        train_loader = DataLoader(train_dataset, batch_size=None, num_workers=8)
         trainer.fit(model, train_loader)
 
     Important Notes:
@@ -541,7 +830,8 @@ class ElectricityIterableDataset(BaseElectricityDataset, IterableDataset):
                  chunksize: int = 10 ** 6, batch_size: int = 32, shuffle: bool = False,
                  normalization_method: str = STANDARDIZATION, noise_factor: float = None,
                  preprocessing_method: str = SupportedPreprocessingMethods.ROLLING_WINDOW, subseq_window: int = None,
-                 fillna_method: str = SupportedFillingMethods.FILL_ZEROS,):
+                 fillna_method: str = SupportedFillingMethods.FILL_ZEROS, lazy_windows: bool = True,
+                 cache: SeriesCache = None,):
         self.batch_size = batch_size
         self.data_len = None
         super().__init__(datasource, building, device,
@@ -550,27 +840,118 @@ class ElectricityIterableDataset(BaseElectricityDataset, IterableDataset):
                          meter_means, meter_stds, sample_period,
                          chunksize, shuffle, normalization_method=normalization_method,
                          preprocessing_method=preprocessing_method, subseq_window=subseq_window,
-                         fillna_method=fillna_method, noise_factor=noise_factor,)
+                         fillna_method=fillna_method, noise_factor=noise_factor, lazy_windows=lazy_windows,
+                         cache=cache,)
 
     def _run(self):
+        """
+        Only the length and the statistics of the series are calculated here. The chunk reader is created in __iter__,
+        so that no prefetching thread is alive when the dataset is copied to the (forked) workers of a DataLoader.
+        """
         self._calc_data_len()
-        self._init_generators(datasource=self.datasource,
-                              building=self.building,
-                              device=self.device,
-                              start_date=self.start_date,
-                              end_date=self.end_date,
-                              sample_period=self.sample_period,
-                              chunksize=self.chunksize)
-        self._reload()
 
     def __getitem__(self, index) -> T_co:
         pass
 
     def __len__(self):
-        return self.data_len
+        """
+        The number of batches that are yielded without dataloader workers (an approximation with many workers).
+        """
+        return math.ceil(self.data_len / self.batch_size)
 
     def _calc_data_len(self):
+        """
+        Sets the length of the dataset and, if they are not given, the normalization parameters of the whole date
+        range. Both are looked up in the cache first. Otherwise they are calculated in a single pass over the chunks and
+        persisted in the metadata index, so that this extra pass over the data takes place only once.
+        """
+        data_len = self._lookup_data_len()
+        mains_stats, meter_stats = self._lookup_stats()
+        if data_len is None or (mains_stats is None and self._needs_stats()):
+            data_len, mains_stats, meter_stats = self._scan_series()
+            if self.cache is not None:
+                source_path = self.datasource.get_path()
+                description = self._describe_windows()
+                self.cache.put_index_entry(SeriesCache.make_key(description), {DATA_LEN: data_len},
+                                           source_path=source_path, description=description)
+                description = self._describe_series(self.fillna_method)
+                self.cache.put_index_entry(SeriesCache.make_key(description),
+                                           {MAINS_STATS: mains_stats.to_dict(), METER_STATS: meter_stats.to_dict()},
+                                           source_path=source_path, description=description)
+        self.data_len = data_len
+        if mains_stats is not None:
+            self._set_stats(mains_stats, meter_stats)
+
+    def _describe_series(self, fillna_method=None):
+        return SeriesCache.describe(self.datasource.get_name(), self.building, self.device,
+                                    [self.start_date, self.end_date], self.sample_period, fillna_method)
+
+    def _describe_windows(self):
+        """
+        The number of windows depends on the chunks and on the windowing of the series as well, so they are part of the
+        description of the length in the metadata index.
+        """
+        description = self._describe_series()
+        preprocessing_method = self.preprocessing_method
+        if isinstance(preprocessing_method, Enum):
+            preprocessing_method = preprocessing_method.value
+        description.update({'chunksize': self.chunksize,
+                            'preprocessing_method': preprocessing_method,
+                            'window_size': self.window_size,
+                            'window_stride': self.window_stride})
+        return description
+
+    def _lookup_data_len(self):
+        """
+        The number of windows is looked up in the metadata index of the cache. None is returned when it is not known
+        yet. The length of a cached series can't be used, since the windows are cut from every chunk separately.
+        """
+        if self.cache is None:
+            return None
+        entry = self.cache.get_index_entry(SeriesCache.make_key(self._describe_windows()),
+                                           source_path=self.datasource.get_path())
+        if entry is not None and DATA_LEN in entry:
+            return entry[DATA_LEN]
+        return None
+
+    def _lookup_stats(self):
+        """
+        The statistics depend on the filling of the NaN values, so they are indexed with the fillna_method as well.
+        """
+        if self.cache is None:
+            return None, None
+        entry = self.cache.get_index_entry(SeriesCache.make_key(self._describe_series(self.fillna_method)),
+                                           source_path=self.datasource.get_path())
+        if entry is None or MAINS_STATS not in entry:
+            return None, None
+        return RunningStats.from_dict(entry[MAINS_STATS]), RunningStats.from_dict(entry[METER_STATS])
+
+    def _needs_stats(self):
+        if self.normalization_method == STANDARDIZATION:
+            return None in [self.means, self.meter_means, self.meter_stds, self.stds]
+        elif self.normalization_method == NORMALIZATION:
+            return self.mmax is None
+        return False
+
+    def _set_stats(self, mains_stats: RunningStats, meter_stats: RunningStats):
+        if self.normalization_method == STANDARDIZATION:
+            if self.means is None and self.stds is None and mains_stats.count:
+                self.means = mains_stats.mean
+                self.stds = mains_stats.std
+            if self.meter_means is None and self.meter_stds is None and meter_stats.count:
+                self.meter_means = meter_stats.mean
+                self.meter_stds = meter_stats.std
+        elif self.normalization_method == NORMALIZATION:
+            if self.mmax is None and mains_stats.count:
+                self.mmax = mains_stats.max
+
+    def _scan_series(self):
+        """
+        A first pass over the chunks, which are aligned and NaN-filled in the same manner as the method _reload, that
+        counts the windows of every chunk and accumulates the statistics of the mains & meter series.
+        """
         data_len = 0
+        mains_stats, meter_stats = RunningStats(), RunningStats()
         self._init_generators(datasource=self.datasource,
                               building=self.building,
                               device=self.device,
@@ -578,46 +959,90 @@ class ElectricityIterableDataset(BaseElectricityDataset, IterableDataset):
                               end_date=self.end_date,
                               sample_period=self.sample_period,
                               chunksize=self.chunksize)
-        has_data = True
-        while has_data:
-            try:
-                mainchunk = next(self.mains_generator)
-                meterchunk = next(self.appliance_generator)
-                mainchunk, meterchunk = align_chunks(mainchunk, meterchunk)
-                data_len += len(mainchunk)
-            except StopIteration:
-                has_data = False
-
-        self.data_len = data_len
+        for mainchunk, meterchunk in self.chunk_reader:
+            mainchunk, meterchunk = align_chunks(mainchunk, meterchunk)
+            data_len += self._count_windows(len(mainchunk))
+            if len(mainchunk):
+                mainchunk, meterchunk = self._fill_nans(mainchunk, meterchunk)
+                mains_stats.update(mainchunk.values)
+                meter_stats.update(meterchunk.values)
+        return data_len, mains_stats, meter_stats
 
     def __iter__(self) -> Iterator[T_co]:
         worker_info = torch.utils.data.get_worker_info()
+        self._init_generators(datasource=self.datasource,
+                              building=self.building,
+                              device=self.device,
+                              start_date=self.start_date,
+                              end_date=self.end_date,
+                              sample_period=self.sample_period,
+                              chunksize=self.chunksize)
+        self.has_more_data = True
+        self._reload()
         return self._series_iterator(worker_info)
 
     def _series_iterator(self, worker_info):
+        """
+        Yields (batch_size, W) batches as slices of the current chunk, or as gathers through the permutation of the
+        chunk if shuffle is True. The next chunk is loaded & preprocessed in a background thread while the current one
+        is drained, and the last incomplete batch of a chunk is completed with the first windows of the next one.
+        """
         batch_size = self.batch_size
+        mainchunk, meterchunk, order = self._partition_chunks(self.mainchunk, self.meterchunk, worker_info)
+        mainleft, meterleft = mainchunk[:0], meterchunk[:0]
+        try:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                next_chunk = executor.submit(self._load_next_chunk) if self.has_more_data else None
+                while True:
+                    length = len(mainchunk) if order is None else len(order)
+                    start = 0
+                    if len(mainleft):
+                        start = min(batch_size - len(mainleft), length)
+                        mainwindows, meterwindows = self._take(mainchunk, meterchunk, order, 0, start)
+                        mainleft = torch.cat((mainleft, mainwindows), 0)
+                        meterleft = torch.cat((meterleft, meterwindows), 0)
+                        if len(mainleft) == batch_size:
+                            yield self._add_noise(mainleft.float()), meterleft.float()
+                            mainleft, meterleft = mainchunk[:0], meterchunk[:0]
+
+                    end = start + (length - start) // batch_size * batch_size
+                    for i in range(start, end, batch_size):
+                        mainwindows, meterwindows = self._take(mainchunk, meterchunk, order, i, i + batch_size)
+                        yield self._add_noise(mainwindows.float()), meterwindows.float()
+                    if end < length:
+                        mainleft, meterleft = self._take(mainchunk, meterchunk, order, end, length)
+
+                    chunk = next_chunk.result() if next_chunk is not None else None
+                    if chunk is None:
+                        break
+                    next_chunk = executor.submit(self._load_next_chunk)
+                    mainchunk, meterchunk, order = self._partition_chunks(*chunk, worker_info)
+        finally:
+            self.chunk_reader.close()
+
+        if len(mainleft):
+            yield self._add_noise(mainleft.float()), meterleft.float()
+
+    def _load_next_chunk(self):
+        self._reload()
+        if not self.has_more_data:
+            return None
+        return self.mainchunk, self.meterchunk
+
+    @staticmethod
+    def _take(mainchunk, meterchunk, order, start, end):
+        index = slice(start, end) if order is None else order[start:end]
+        return mainchunk[index], meterchunk[index]
+
+    def _partition_chunks(self, mainchunk, meterchunk, worker_info):
+        """
+        Every worker gets a contiguous part of the chunk. If shuffle is True, the part is drained in the order of a
+        permutation that is drawn by the worker, so the windows of the workers never overlap.
+        """
         if self._should_partition(worker_info):
-            self._partition_chunks(worker_info)
-
-        mainqueue = deque(self.mainchunk)
-        meterqueue = deque(self.meterchunk)
-        while True:
-            mainval = mainqueue.popleft()
-            meterval = meterqueue.popleft()
-            if len(mainqueue) < batch_size and self.has_more_data:
-                self._reload()
-                if not self.mainchunk.nelement() or not self.meterchunk.nelement():
-                    return
-                if self._should_partition(worker_info):
-                    self._partition_chunks(worker_info)
-                mainqueue.extend(self.mainchunk)
-                meterqueue.extend(self.meterchunk)
-            yield mainval, meterval
-
-    def _partition_chunks(self, worker_info):
-        iter_start, iter_end = self._partition(worker_info, len(self.mainchunk))
-        self.mainchunk = self.mainchunk[iter_start:iter_end]
-        self.meterchunk = self.meterchunk[iter_start:iter_end]
+            iter_start, iter_end = self._partition(worker_info, len(mainchunk))
+            mainchunk, meterchunk = mainchunk[iter_start:iter_end], meterchunk[iter_start:iter_end]
+        return mainchunk, meterchunk, self._shuffled_indices(len(mainchunk))
 
     @staticmethod
     def _partition(worker_info, chunksize):
@@ -629,4 +1054,3 @@ class ElectricityIterableDataset(BaseElectricityDataset, IterableDataset):
     @staticmethod
     def _should_partition(worker_info):
         return worker_info is not None and worker_info.num_workers > 1
-
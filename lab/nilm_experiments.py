@@ -8,14 +8,17 @@ from constants.constants import *
 from lab.nilm_trainer import train_eval
 from constants.appliance_windows import WINDOWS
 from datasources.datasource import Datasource
-from datasources.datasource import DatasourceFactory
-from torch.utils.data import DataLoader, random_split
+from datasources.datasource import DatasourceFactory, DatasourcePool
+from datasources.series_cache import SeriesCache, SeriesMemo
+from datasources.samplers import BlockBatchSampler
+from torch.utils.data import DataLoader
 from utils.helpers import create_tree_dir, create_time_folds
 from callbacks.callbacks_factories import TrainerCallbacksFactory
 from utils.nilm_reporting import get_final_report, get_statistical_report
 from constants.enumerates import SupportedNilmExperiments, SupportedExperimentCategories, SupportedExperimentVolumes, \
     ElectricalAppliances, SupportedPreprocessingMethods, SupportedFillingMethods
-from datasources.torchdataset import ElectricityDataset, ElectricityMultiBuildingsDataset, ElectricityIterableDataset
+from datasources.torchdataset import ElectricityDataset, ElectricityMultiBuildingsDataset, ElectricityIterableDataset, \
+    load_aligned_series
 
 with torch.no_grad():
     torch.cuda.empty_cache()
@@ -31,6 +34,16 @@ class ExperimentParameters:
         inference_cpu (bool): controls whether the inference should be executed on cpu or on gpu
         sample_period (int): the sample period of the data
         batch_size (int): the batch size
+        inference_batch_size (int): the batch size of the evaluation (check: lab/predictor). If None is given,
+            the batch_size is used.
+        dense_inference (bool): whether the models that support it (e.g. Seq2Point) should run the dense inference on
+            the test windows, which is equivalent to the inference on every window (check: lab/predictor)
+        inference_stride (int): the stride of the test windows of SEQ_T0_SEQ and SEQ_T0_SUBSEQ, between 1 and the
+            output window (check: datasources/torchdataset). The outputs of the overlapping windows are averaged.
+        mc_samples (int): the number of Monte-Carlo weight samples of the evaluation of the Bayesian models. If None
+            is given, a single forward pass is used.
+        latent_samples (int): the number of latent samples that the VIB models average in the evaluation, decoded in
+            one batched pass. If None is given, the mean of the latent distribution is decoded.
         iterable_dataset (bool):  whether the train dataset should be iterable or not (check: datasources/torchdataset)
         preprocessing_method (SupportedPreprocessingMethods): the desired preprocessing method
         fillna_method (SupportedFillingMethods): the desired filling NA method
@@ -64,7 +77,8 @@ class ExperimentParameters:
                  preprocessing_method: SupportedPreprocessingMethods = SupportedPreprocessingMethods.ROLLING_WINDOW,
                  fillna_method: SupportedFillingMethods = SupportedFillingMethods.FILL_ZEROS,
                  fixed_window: int = None, subseq_window: int = None, train_test_split: float = 0.8, cv_folds: int = 3,
-                 noise_factor: float = None, ):
+                 noise_factor: float = None, inference_batch_size: int = None, dense_inference: bool = False,
+                 inference_stride: int = 1, mc_samples: int = None, latent_samples: int = None, ):
 
         self.params = {
             EPOCHS: epochs,
@@ -80,6 +94,11 @@ class ExperimentParameters:
             TRAIN_TEST_SPLIT: train_test_split,
             CV_FOLDS: cv_folds,
             NOISE_FACTOR: noise_factor,
+            INFERENCE_BATCH_SIZE: inference_batch_size,
+            DENSE_INFERENCE: dense_inference,
+            INFERENCE_STRIDE: inference_stride,
+            MC_SAMPLES: mc_samples,
+            LATENT_SAMPLES: latent_samples,
         }
 
     def get_params(self):
@@ -248,6 +267,10 @@ class NILMExperiments:
         data_dir(str): The directory of the data. If None is given, the path in datasources/paths_manager.py is used.
         train_file_dir(str): The directory of the date files. If None is given, the files in benchmark dir are used.
         test_file_dir(str): The directory of the date files. If None is given, the files in benchmark dir are used.
+        use_series_cache(bool): The flag controls whether the aligned series should be cached on disk (output/cache),
+            so that every model, iteration and fold after the first one skips the NILMTK loading & alignment.
+            The cache is invalidated when the source HDF5 file changes.
+            Default: True
 
     Functionality in a nut-shell:
         After input arguments are initialized, the experiment properties can be used as APIs.
@@ -326,7 +349,7 @@ class NILMExperiments:
                  experiment_type: SupportedNilmExperiments = None, experiment_parameters: ExperimentParameters = None,
                  model_hparams: ModelHyperModelParameters = None, hparam_tuning: HyperParameterTuning = None,
                  data_dir: str = None, train_file_dir: str = None, test_file_dir: str = None, save_model: bool = False,
-                 save_preprocessing_params: bool = False,):
+                 save_preprocessing_params: bool = False, use_series_cache: bool = True,):
 
         self.project_name = project_name
         self.clean_project = clean_project
@@ -344,6 +367,14 @@ class NILMExperiments:
         self.data_dir = data_dir
         self.train_file_dir = train_file_dir
         self.test_file_dir = test_file_dir
+        if use_series_cache:
+            self.series_cache = SeriesCache('/'.join([os.getcwd(), DIR_OUTPUT_NAME, DIR_CACHE_NAME]))
+        else:
+            self.series_cache = None
+        self.series_memo = SeriesMemo(self.series_cache)
+        self.test_series_memo = SeriesMemo(self.series_memo)
+        self.cv_parameters = {}
+        self.train_datasources = []
 
     def _prepare_project_properties(self, devices: list = None, experiment_parameters: ExperimentParameters = None,
                                     data_dir: str = None, train_file_dir: str = None, test_file_dir: str = None,
@@ -436,6 +467,11 @@ class NILMExperiments:
         self.train_test_split = 0.8
         self.cv_folds = 3
         self.noise_factor = None
+        self.inference_batch_size = None
+        self.dense_inference = False
+        self.inference_stride = 1
+        self.mc_samples = None
+        self.latent_samples = None
 
     def _set_experiment_parameters(self, experiment_parameters: ExperimentParameters = None):
         if experiment_parameters:
@@ -453,6 +489,11 @@ class NILMExperiments:
             self.train_test_split = experiment_parameters[TRAIN_TEST_SPLIT]
             self.cv_folds = experiment_parameters[CV_FOLDS]
             self.noise_factor = experiment_parameters[NOISE_FACTOR]
+            self.inference_batch_size = experiment_parameters[INFERENCE_BATCH_SIZE]
+            self.dense_inference = experiment_parameters[DENSE_INFERENCE]
+            self.inference_stride = experiment_parameters[INFERENCE_STRIDE]
+            self.mc_samples = experiment_parameters[MC_SAMPLES]
+            self.latent_samples = experiment_parameters[LATENT_SAMPLES]
         else:
             warnings.warn('No experiment parameters are defined. So, default parameters will be used.')
             self._set_default_experiment_parameters()
@@ -538,8 +579,14 @@ class NILMExperiments:
         self.clean_project = False
 
     def _prepare_cv_parameters(self, experiment_category: SupportedExperimentVolumes = None, device: str = None):
+        """
+        The train file is read and the house is loaded only for the first fold of a device, the rest of the folds reuse
+        the same parameters and the series that were shared by _share_cv_folds.
+        """
         if not experiment_category:
             experiment_category = SupportedExperimentCategories.SINGLE_CATEGORY.value
+        if (experiment_category, device) in self.cv_parameters:
+            return self.cv_parameters[(experiment_category, device)]
         try:
             file = open('{}base{}TrainSetsInfo_{}'.format(self.train_file_dir, experiment_category, device), 'r')
         except Exception as e:
@@ -554,12 +601,34 @@ class NILMExperiments:
         file.close()
         if train_set and dates and train_house:
             datasource = DatasourceFactory.create_datasource(train_set)
+            self.train_datasources.append(datasource)
             time_folds = create_time_folds(start_date=dates[0], end_date=dates[1],
                                            folds=self.cv_folds, drop_last=False)
+            self._share_cv_folds(datasource, device, train_house, dates, time_folds)
+            self.cv_parameters[(experiment_category, device)] = datasource, time_folds, train_set, train_house
             return datasource, time_folds, train_set, train_house
         else:
             raise Exception('Not a proper train file')
 
+    def _share_cv_folds(self, datasource: Datasource = None, device: str = None, train_house: int = None,
+                        dates: list = None, time_folds: dict = None):
+        """
+        The whole date range of the house is loaded once and the train & test dates of every fold are put in the
+        series memo as slices of it. Thus, the datasets of the folds find their series in the memo and the house is
+        read once for all the folds, instead of twice per fold.
+        """
+        series = load_aligned_series(datasource, train_house, device, dates[0], dates[1], self.sample_period,
+                                     10 ** 10, self.fillna_method, self.series_memo)
+        fold_dates = []
+        for fold in time_folds.values():
+            fold_dates.extend([train_date for train_date in fold[TRAIN_DATES] if len(train_date)])
+            fold_dates.append(fold[TEST_DATES])
+        for fold_date in fold_dates:
+            description = SeriesCache.describe(datasource.get_name(), train_house, device, fold_date,
+                                               self.sample_period, self.fillna_method)
+            self.series_memo.put(SeriesCache.make_key(description), series.slice_dates(*fold_date),
+                                 description=description, persist=False)
+
     def _prepare_cv_dataset(self, device: str = None, fold: int = None, window: int = None, datasource: Datasource = None,
                             time_folds: list = None, train_house: int = None):
 
@@ -578,7 +647,8 @@ class NILMExperiments:
                                                              sample_period=self.sample_period,
                                                              preprocessing_method=self.preprocessing_method,
                                                              fillna_method=self.fillna_method,
-                                                             subseq_window=self.subseq_window,)
+                                                             subseq_window=self.subseq_window,
+                                                             cache=self.series_memo,)
         return train_dataset_all
 
     def _prepare_train_dataset(self, experiment_category: SupportedExperimentCategories = None, device: str = None,
@@ -591,6 +661,7 @@ class NILMExperiments:
             train_house = toks[1]
             train_dates = [str(toks[2]), str(toks[3].rstrip("\n"))]
             datasource = DatasourceFactory.create_datasource(train_set)
+            self.train_datasources.append(datasource)
             if experiment_category == SupportedExperimentCategories.MULTI_CATEGORY:
                 train_info.append({
                     COLUMN_DEVICE: device,
@@ -610,7 +681,9 @@ class NILMExperiments:
                                                                    preprocessing_method=self.preprocessing_method,
                                                                    fillna_method=self.fillna_method,
                                                                    subseq_window=self.subseq_window,
-                                                                   noise_factor=self.noise_factor)
+                                                                   noise_factor=self.noise_factor,
+                                                                   batch_size=self.batch_size,
+                                                                   cache=self.series_memo)
                 else:
                     train_dataset_all = ElectricityDataset(datasource=datasource,
                                                            building=int(train_house),
@@ -621,7 +694,8 @@ class NILMExperiments:
                                                            preprocessing_method=self.preprocessing_method,
                                                            fillna_method=self.fillna_method,
                                                            subseq_window=self.subseq_window,
-                                                           noise_factor=self.noise_factor)
+                                                           noise_factor=self.noise_factor,
+                                                           cache=self.series_memo)
 
                 return train_dataset_all
         file.close()
@@ -631,27 +705,33 @@ class NILMExperiments:
                                                              preprocessing_method=self.preprocessing_method,
                                                              fillna_method=self.fillna_method,
                                                              subseq_window=self.subseq_window,
-                                                             noise_factor=self.noise_factor)
+                                                             noise_factor=self.noise_factor,
+                                                             cache=self.series_memo)
         return train_dataset_all
 
     def _prepare_train_val_loaders(self, train_dataset_all: Union[ElectricityDataset,
                                                                   ElectricityMultiBuildingsDataset,
                                                                   ElectricityIterableDataset] = None):
         if train_dataset_all:
-            if self.iterable_dataset or not self.train_test_split:
-                train_loader = DataLoader(train_dataset_all, batch_size=self.batch_size,
-                                          shuffle=True, num_workers=os.cpu_count())
+            if self.iterable_dataset:
+                train_loader = DataLoader(train_dataset_all, batch_size=None, num_workers=os.cpu_count())
+                return train_loader, None
+            elif not self.train_test_split:
+                train_sampler = BlockBatchSampler(len(train_dataset_all), self.batch_size, shuffle=True)
+                train_loader = DataLoader(train_dataset_all, batch_size=None, sampler=train_sampler,
+                                          num_workers=os.cpu_count())
                 return train_loader, None
             else:
                 train_size = int(self.train_test_split * len(train_dataset_all))
-                val_size = len(train_dataset_all) - train_size
-                train_dataset, val_dataset = random_split(train_dataset_all, [train_size, val_size],
-                                                          generator=torch.Generator().manual_seed(42))
-
-                train_loader = DataLoader(train_dataset, batch_size=self.batch_size,
-                                          shuffle=True, num_workers=os.cpu_count())
-                val_loader = DataLoader(val_dataset, batch_size=self.batch_size,
-                                        shuffle=False, num_workers=os.cpu_count())
+                # the same permutation as random_split(..., generator=torch.Generator().manual_seed(42))
+                indices = torch.randperm(len(train_dataset_all), generator=torch.Generator().manual_seed(42))
+                train_sampler = BlockBatchSampler(indices[:train_size], self.batch_size, shuffle=True)
+                val_sampler = BlockBatchSampler(indices[train_size:], self.batch_size, shuffle=False)
+
+                train_loader = DataLoader(train_dataset_all, batch_size=None, sampler=train_sampler,
+                                          num_workers=os.cpu_count())
+                val_loader = DataLoader(train_dataset_all, batch_size=None, sampler=val_sampler,
+                                        num_workers=os.cpu_count())
                 return train_loader, val_loader
         else:
             raise Exception('Empty Dataset object given')
@@ -735,10 +815,38 @@ class NILMExperiments:
             TESTS_PARAMS: tests_params,
             EVAL_PARAMS: eval_params,
             EXPERIMENT_NAME: experiment_name,
+            SERIES_CACHE: self.test_series_memo,
+            INFERENCE_BATCH_SIZE: self.inference_batch_size,
+            DENSE_INFERENCE: self.dense_inference,
+            INFERENCE_STRIDE: self.inference_stride,
+            MC_SAMPLES: self.mc_samples,
+            LATENT_SAMPLES: self.latent_samples,
         }
 
         return train_eval_args
 
+    def _release_series(self):
+        """
+        The experiments are scheduled around the data: all the models of a device run one after the other, so the
+        aligned series of the device are loaded once in the series memo and are released when the device is done.
+        The test series are kept in their own memo, which lives for the whole run (check: _release_test_series),
+        since the same test houses & dates are evaluated by every model, iteration and experiment category.
+        The datasources of the training houses are released as well and the ones that aren't used anymore are closed.
+        """
+        self.series_memo.clear()
+        self.cv_parameters = {}
+        for datasource in self.train_datasources:
+            DatasourcePool.release(datasource)
+        self.train_datasources = []
+        DatasourcePool.close_idle()
+        if self.experiment_type in [SupportedNilmExperiments.CROSS_VALIDATION,
+                                    SupportedNilmExperiments.HYPERPARAM_TUNE_CV]:
+            # the test sets of the folds are slices of the training house, so they are released with it
+            self.test_series_memo.clear()
+
+    def _release_test_series(self):
+        self.test_series_memo.clear()
+
     @staticmethod
     def _call_train_eval(args):
         train_eval(**args)
@@ -909,9 +1017,9 @@ class NILMExperiments:
 
         for experiment_category in self.experiment_categories:
             print('EXPERIMENT CATEGORY: ', experiment_category)
-            for model_name in self.models:
-                model_hparams = self.model_hparams.get_model_params(model_name)
-                for device in self.devices:
+            for device in self.devices:
+                for model_name in self.models:
+                    model_hparams = self.model_hparams.get_model_params(model_name)
                     model_hparams, window = self._calculate_model_window(model_hparams=model_hparams,
                                                                          model_name=model_name, device=device)
                     model_hparams = self._set_model_output_dim(model_hparams, output_dim=window)
@@ -926,6 +1034,8 @@ class NILMExperiments:
                         self._call_train_eval(
                             train_eval_args
                         )
+                self._release_series()
+        self._release_test_series()
         if export_report:
             self.export_report(save_name=STAT_REPORT,
                                stat_measures=stat_measures,
@@ -991,9 +1101,9 @@ class NILMExperiments:
                                          )
         for experiment_category in self.experiment_categories:
             print('EXPERIMENT CATEGORY: ', experiment_category)
-            for model_name in self.models:
-                model_hparams = self.model_hparams.get_model_params(model_name)
-                for device in self.devices:
+            for device in self.devices:
+                for model_name in self.models:
+                    model_hparams = self.model_hparams.get_model_params(model_name)
                     model_hparams, window = self._calculate_model_window(model_hparams=model_hparams,
                                                                          model_name=model_name, device=device)
                     model_hparams = self._set_model_output_dim(model_hparams, output_dim=window)
@@ -1008,6 +1118,8 @@ class NILMExperiments:
                         self._call_train_eval(
                             train_eval_args
                         )
+                self._release_series()
+        self._release_test_series()
         if export_report:
             self.export_report(save_name=STAT_REPORT,
                                stat_measures=stat_measures,
@@ -1084,11 +1196,11 @@ class NILMExperiments:
 
         for experiment_category in self.experiment_categories:
             print('EXPERIMENT CATEGORY: ', experiment_category)
-            for model_name in self.models:
-                model_hparams_list = self.hparam_tuning.get_model_params(model_name)
-                for model_index, model_hparams in enumerate(model_hparams_list):
-                    print(model_hparams, model_index)
-                    for device in self.devices:
+            for device in self.devices:
+                for model_name in self.models:
+                    model_hparams_list = self.hparam_tuning.get_model_params(model_name)
+                    for model_index, model_hparams in enumerate(model_hparams_list):
+                        print(model_hparams, model_index)
                         model_hparams, window = self._calculate_model_window(model_hparams=model_hparams,
                                                                              model_name=model_name, device=device)
                         model_hparams = self._set_model_output_dim(model_hparams, output_dim=window)
@@ -1104,6 +1216,8 @@ class NILMExperiments:
                             self._call_train_eval(
                                 train_eval_args
                             )
+                self._release_series()
+        self._release_test_series()
         if export_report:
             self.export_report(save_name=STAT_REPORT,
                                stat_measures=stat_measures,
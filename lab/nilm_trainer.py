@@ -1,14 +1,19 @@
 import os
+from typing import Union
+import torch
 import numpy as np
 import pandas as pd
 from datetime import datetime
 import pytorch_lightning as pl
 from constants.constants import*
 from torch.utils.data import DataLoader
+from lab.predictor import Predictor
 from lab.training_tools import TrainingToolsFactory
 from utils.nilm_reporting import save_appliance_report
-from datasources.datasource import DatasourceFactory
+from datasources.datasource import DatasourceFactory, DatasourcePool
 from datasources.torchdataset import  ElectricityDataset
+from datasources.preprocessing_lib import series_from_windows
+from datasources.series_cache import SeriesCache, SeriesMemo
 from constants.enumerates import SupportedPreprocessingMethods, SupportedFillingMethods
 
 
@@ -20,11 +25,25 @@ def train_eval(model_name: str, train_loader: DataLoader, tests_params: pd.DataF
                fillna_method: str = SupportedFillingMethods.FILL_ZEROS, inference_cpu: bool = False,
                experiment_type: str = None, experiment_category: str = None, subseq_window: int = None,
                save_model: bool = False, saved_models_dir: str = DIR_SAVED_MODELS_NAME, model_index: int = None,
-               save_preprocessing_params: bool = True, output_dir: str = DIR_OUTPUT_NAME, progress_bar: bool = True, ):
+               save_preprocessing_params: bool = True, output_dir: str = DIR_OUTPUT_NAME, progress_bar: bool = True,
+               series_cache: Union[SeriesCache, SeriesMemo] = None, inference_batch_size: int = None,
+               dense_inference: bool = False, inference_stride: int = 1, mc_samples: int = None,
+               latent_samples: int = None, ):
     """
     Inputs:
         model_name - Name of the model you want to run.
             It's used to look up the class in "model_dict"
+        series_cache - The cache of the raw aligned test series. If a SeriesMemo is given, every test house is loaded
+            once for all the calls that share the memo and only the normalization with the statistics of the current
+            training set and the windowing take place in every evaluation.
+        inference_batch_size - The batch size of the evaluation (check: lab/predictor), if None the batch_size is used.
+        dense_inference - Whether the models that support it should run the dense inference on the test windows.
+        inference_stride - The stride of the test windows of SEQ_T0_SEQ and SEQ_T0_SUBSEQ. A stride equal to the
+            output window evaluates non-overlapping tiles, smaller strides average the overlapping outputs.
+        mc_samples - The number of Monte-Carlo weight samples of the evaluation of the Bayesian models. If given, the
+            predictive variance is reported next to the predictions.
+        latent_samples - The number of latent samples that the VIB models average in the evaluation. If None, the
+            mean of the latent distribution is decoded.
     """
 
     if progress_bar:
@@ -84,24 +103,31 @@ def train_eval(model_name: str, train_loader: DataLoader, tests_params: pd.DataF
                                           meter_means=meter_means, meter_stds=meter_stds,
                                           sample_period=sample_period,
                                           preprocessing_method=preprocessing_method,
-                                          fillna_method=fillna_method,)
+                                          fillna_method=fillna_method,
+                                          cache=series_cache, window_stride=inference_stride,)
 
-        test_loader = DataLoader(test_dataset, batch_size=batch_size,
-                                 shuffle=False, num_workers=8)
 
         if preprocessing_method in [SupportedPreprocessingMethods.ROLLING_WINDOW,
                                     SupportedPreprocessingMethods.MIDPOINT_WINDOW]:
+            stride = None
             ground = test_dataset.meterchunk.numpy()
         else:
-            ground = test_dataset.meterchunk.numpy()
-            ground = np.reshape(ground, -1)
+            # the sequence outputs overlap on the timeline, so they are evaluated with one value per timestamp
+            stride = inference_stride
+            ground = series_from_windows(test_dataset.meterchunk, stride).numpy()
         if inference_cpu:
             print('Model to CPU')
-            model.to(CPU_NAME)
+            inference_device = CPU_NAME
+        else:
+            inference_device = 'cuda' if torch.cuda.is_available() else CPU_NAME
         model.set_ground(ground)
 
-        trainer.test(model, test_dataloaders=test_loader)
-        model_results = model.get_res()
+        predictor = Predictor(model, batch_size=inference_batch_size or batch_size, device=inference_device,
+                              dense=dense_inference, mc_samples=mc_samples, latent_samples=latent_samples)
+        model_results = predictor.evaluate(test_dataset, ground=ground, stride=stride)
+        model.set_res(model_results)
+        print('#### model name: {} ####'.format(model_results[COLUMN_MODEL]))
+        print('metrics: {}'.format(model_results[COLUMN_METRICS]))
         final_experiment_name = experiment_name + TEST_ID + building + '_' + dataset
 
         save_appliance_report(root_dir=root_dir, model_name=model_name, device=device,
@@ -109,4 +135,5 @@ def train_eval(model_name: str, train_loader: DataLoader, tests_params: pd.DataF
                               save_timeseries=save_timeseries, experiment_name=final_experiment_name,
                               iteration=iteration, model_results=model_results, model_hparams=model_hparams,
                               epochs=epochs, model_index=model_index)
-        del test_dataset, test_loader, ground, final_experiment_name
+        DatasourcePool.release(datasource)
+        del test_dataset, predictor, ground, final_experiment_name
@@ -0,0 +1,225 @@
+from functools import partial
+from typing import Iterator, Optional, Tuple, Union
+
+import numpy as np
+import torch
+from torch import Tensor
+from torch.utils.data import Dataset, IterableDataset
+
+from constants.constants import *
+from constants.appliance_thresholds import ON_THRESHOLDS
+from constants.enumerates import ElectricalAppliances
+from datasources.preprocessing_lib import OverlapAdder
+from datasources.samplers import BlockBatchSampler
+from lab.training_tools import ClassicTrainingTools
+from neural_networks.base_models import BaseModel
+from utils.helpers import denormalize, destandardize
+from utils.nilm_metrics import NILMMetricsAccumulator
+
+DEFAULT_INFERENCE_BATCH_SIZE = 1024
+
+
+class Predictor:
+    """
+    -Predictor
+
+    A lean inference engine for trained models, without the logging and the per step bookkeeping of a lightning
+    trainer.test. The model runs under torch.inference_mode in eval mode, on batches of inference_batch size which is
+    independent of the training batch size, and the predictions are returned de-normalized with the statistics of the
+    training set (mmax or meter means/stds of eval_params).
+
+    Args:
+        model(ClassicTrainingTools or BaseModel): the trained model
+        eval_params(dict): the evaluation parameters (device, mmax, means, stds) of the model.
+            If None is given, the eval_params of the training tools are used.
+        batch_size(int): the inference batch size
+            Default: 1024
+        device(str): the device the inference runs on. If None is given, the current device of the model is used.
+        dense(bool): run the dense inference of the models that support it (check: BaseModel.supports_dense) on the
+            consecutive windows of every batch, instead of running the model on every window
+            Default: False
+        mc_samples(int): the number of Monte-Carlo weight samples of the Bayesian models (check:
+            BaseModel.supports_bayes), which are drawn in one vectorized forward. If given, the predictions are the
+            predictive mean of the samples and the results of evaluate also contain the predictive variance.
+            Default: None
+        latent_samples(int): the number of latent samples of the VIB models (check: BaseModel.supports_vib), which
+            are decoded in one batched pass and averaged. If None is given, the mean of the latent distribution is
+            decoded, which is deterministic.
+            Default: None
+
+    Example of use:
+        predictor = Predictor(model, batch_size=4096)
+        preds = predictor.predict(test_dataset)
+        results = predictor.evaluate(test_dataset, ground=test_dataset.meterchunk.numpy())
+
+    The outputs of SEQ_T0_SEQ and SEQ_T0_SUBSEQ models are windows that overlap on the timeline. If the stride of
+    the windows is given, every batch is overlap-added on the timeline as soon as it is produced and averaged (check:
+    datasources/preprocessing_lib.OverlapAdder), so that the predictions and the metrics have one value per timestamp.
+    """
+    def __init__(self, model: Union[ClassicTrainingTools, BaseModel], eval_params: dict = None,
+                 batch_size: int = DEFAULT_INFERENCE_BATCH_SIZE, device: str = None, dense: bool = False,
+                 mc_samples: int = None, latent_samples: int = None):
+        self.model = model
+        network = model.model if isinstance(model, ClassicTrainingTools) else model
+        self.mc_samples = mc_samples if mc_samples and network.supports_bayes() else None
+        if self.mc_samples:
+            self.forward = partial(network.forward_mc, num_samples=self.mc_samples)
+        elif network.supports_vib():
+            self.forward = partial(network.forward_inference, num_sample=latent_samples)
+        elif dense and network.supports_dense():
+            self.forward = network.forward_dense
+        else:
+            self.forward = model
+        if eval_params is None:
+            eval_params = getattr(model, 'eval_params', None) or {}
+        self.eval_params = eval_params
+        self.batch_size = batch_size or DEFAULT_INFERENCE_BATCH_SIZE
+        if device is None:
+            device = next(model.parameters()).device
+        self.device = torch.device(device)
+
+    def get_model_name(self) -> str:
+        if isinstance(self.model, ClassicTrainingTools):
+            return self.model.model_name
+        return self.model.architecture_name
+
+    def predict(self, data: Union[Dataset, IterableDataset, Tensor, np.array], stride: int = None) -> np.array:
+        """
+        Returns the de-normalized predictions of the given data, which can be a dataset that returns (inputs, targets)
+        batches (check: datasources/torchdataset) or an array with the normalized input windows of the model.
+        If the stride of sequence outputs is given, the predictions are reconstructed on the timeline.
+        """
+        if stride is None:
+            preds = [outputs.reshape(-1) for outputs, _, _ in self._predict_batches(data)]
+            return self._denormalize(self._concatenate(preds))
+        adder = OverlapAdder(stride, num_windows=self._num_windows(data))
+        for outputs, _, _ in self._predict_batches(data):
+            adder.update(outputs)
+        return self._denormalize(self._concatenate([adder.compute()]))
+
+    def evaluate(self, dataset: Union[Dataset, IterableDataset], ground: np.array = None, stride: int = None) -> dict:
+        """
+        Returns the predictions, the ground truth and the NILM metrics of the dataset in the same format as the
+        results of the training tools. The metrics are accumulated batch by batch from the targets of the dataset or,
+        if the stride of sequence outputs is given, calculated on the reconstructed timeline of the predictions and
+        the targets.
+        """
+        accumulator = NILMMetricsAccumulator(
+            threshold=ON_THRESHOLDS.get(ElectricalAppliances(self.eval_params[COLUMN_DEVICE]), 50))
+        if stride is not None:
+            preds, targets, variances = self._overlap_add_batches(dataset, stride, collect_targets=ground is None)
+            if preds:
+                timeline = torch.cat(targets) if ground is None else torch.as_tensor(ground, device=preds[0].device)
+                accumulator.update(self._denormalize(preds[0].double()), self._denormalize(timeline.double()))
+        else:
+            preds, targets, variances = [], [], []
+            for outputs, labels, variance in self._predict_batches(dataset):
+                outputs, labels = outputs.reshape(-1), labels.reshape(-1)
+                accumulator.update(self._denormalize(outputs.double()), self._denormalize(labels.double()))
+                preds.append(outputs)
+                if ground is None:
+                    targets.append(labels)
+                if variance is not None:
+                    variances.append(variance.reshape(-1))
+        if ground is None:
+            ground = self._concatenate(targets)
+
+        results = {COLUMN_MODEL: self.get_model_name(),
+                   COLUMN_METRICS: accumulator.compute(),
+                   COLUMN_PREDICTIONS: self._denormalize(self._concatenate(preds)),
+                   COLUMN_GROUNDTRUTH: self._denormalize(ground), }
+        if variances:
+            results[COLUMN_PREDICTIONS_VARIANCE] = self._denormalize_variance(self._concatenate(variances))
+        return results
+
+    def _overlap_add_batches(self, dataset: Union[Dataset, IterableDataset], stride: int, collect_targets: bool):
+        """
+        Overlap-adds the outputs, and the predictive variances if any, of every batch on the timeline as soon as they
+        are produced. If collect_targets is True, the target series is rebuilt from the first stride values of every
+        target window and the tail of the last one (check: datasources/preprocessing_lib.series_from_windows).
+        """
+        num_windows = self._num_windows(dataset)
+        preds_adder = OverlapAdder(stride, num_windows=num_windows)
+        variances_adder = OverlapAdder(stride, num_windows=num_windows) if self.mc_samples else None
+        targets, last_labels = [], None
+        for outputs, labels, variance in self._predict_batches(dataset):
+            preds_adder.update(outputs)
+            if variances_adder is not None:
+                variances_adder.update(variance)
+            if collect_targets and len(labels):
+                targets.append(labels[:, :stride].reshape(-1))
+                last_labels = labels[-1]
+        if not preds_adder.seen:
+            return [], [], []
+        if last_labels is not None:
+            targets.append(last_labels[stride:])
+        variances = [variances_adder.compute()] if variances_adder is not None else []
+        return [preds_adder.compute()], targets, variances
+
+    @staticmethod
+    def _num_windows(data) -> Optional[int]:
+        if isinstance(data, IterableDataset):
+            return None
+        return len(data)
+
+    def _predict_batches(self, data) -> Iterator[Tuple[Tensor, Tensor, Optional[Tensor]]]:
+        """
+        Yields the outputs of the model for every batch, [batch_size, output_dim], together with the targets of the
+        batch (None if the data are plain input windows) and the predictive variance of the outputs (None if no
+        Monte-Carlo samples are drawn). The outputs stay on the device of the inference until they are collected.
+        """
+        training = self.model.training
+        self.model.to(self.device)
+        self.model.eval()
+        try:
+            with torch.inference_mode():
+                for inputs, labels in self._batches(data):
+                    outputs = self.forward(inputs.to(self.device, non_blocking=True).float())
+                    if isinstance(outputs, tuple):
+                        # e.g. the VIB models return ((mu, std), outputs)
+                        outputs = outputs[-1]
+                    variances = None
+                    if self.mc_samples:
+                        outputs = outputs.reshape(self.mc_samples, len(inputs), -1)
+                        outputs, variances = outputs.mean(0), outputs.var(0, unbiased=False)
+                    yield outputs.reshape(len(outputs), -1), labels, variances
+        finally:
+            self.model.train(training)
+
+    def _batches(self, data) -> Iterator[Tuple[Tensor, Tensor]]:
+        if isinstance(data, (Tensor, np.ndarray)):
+            inputs = torch.as_tensor(data)
+            for start in range(0, len(inputs), self.batch_size):
+                yield inputs[start:start + self.batch_size], None
+        elif isinstance(data, IterableDataset):
+            for inputs, labels in data:
+                yield inputs, labels.to(self.device, non_blocking=True)
+        else:
+            for block in BlockBatchSampler(len(data), self.batch_size):
+                inputs, labels = data[block]
+                yield inputs, labels.to(self.device, non_blocking=True)
+
+    def _concatenate(self, batches: list) -> np.array:
+        if not batches:
+            return np.array([], dtype=np.float32)
+        return torch.cat(batches).float().cpu().numpy()
+
+    def _denormalize(self, data):
+        mmax = self.eval_params.get(COLUMN_MMAX)
+        means = self.eval_params.get(COLUMN_MEANS)
+        stds = self.eval_params.get(COLUMN_STDS)
+        if mmax:
+            return denormalize(data, mmax)
+        elif means and stds:
+            return destandardize(data, means, stds)
+        return data
+
+    def _denormalize_variance(self, variances):
+        mmax = self.eval_params.get(COLUMN_MMAX)
+        means = self.eval_params.get(COLUMN_MEANS)
+        stds = self.eval_params.get(COLUMN_STDS)
+        if mmax:
+            return variances * mmax ** 2
+        elif means and stds:
+            return variances * stds ** 2
+        return variances
@@ -0,0 +1,254 @@
+import time
+from typing import Optional, Tuple, Union
+
+import numpy as np
+import torch
+
+from constants.constants import *
+from constants.enumerates import SupportedPreprocessingMethods, SupportedFillingMethods
+from lab.training_tools import ClassicTrainingTools
+from neural_networks.base_models import BaseModel
+
+STREAMING_METHODS = [SupportedPreprocessingMethods.ROLLING_WINDOW,
+                     SupportedPreprocessingMethods.MIDPOINT_WINDOW,
+                     SupportedPreprocessingMethods.SEQ_T0_SUBSEQ]
+
+
+class RingBuffer:
+    """
+    -RingBuffer
+
+    A fixed-size buffer of the last size values of a stream. Every value is written twice, at position i and i + size
+    of a 2 * size array, so that the last size values are always a contiguous slice and window() returns a view of
+    them in chronological order without any copy. Both append and window are O(1).
+
+    Args:
+        size(int): the number of values that are kept
+        dtype: the dtype of the values
+            Default: np.float32
+    """
+    def __init__(self, size: int, dtype=np.float32):
+        self.size = size
+        self.buffer = np.zeros(2 * size, dtype=dtype)
+        self.position = 0
+        self.count = 0
+
+    def append(self, value):
+        self.buffer[self.position] = value
+        self.buffer[self.position + self.size] = value
+        self.position = (self.position + 1) % self.size
+        self.count += 1
+
+    def is_full(self) -> bool:
+        return self.count >= self.size
+
+    def window(self) -> np.array:
+        return self.buffer[self.position:self.position + self.size]
+
+
+class StreamingDisaggregator:
+    """
+    -StreamingDisaggregator
+
+    Online disaggregation of mains readings that arrive one at a time (every sample_period seconds). The readings of
+    every mains meter are kept in a ring buffer of window_size values, they are NaN-filled and normalized in the same
+    way as in BaseElectricityDataset._chunk_preprocessing and, as soon as a new reading completes a window, the model is
+    called on it and the de-normalized estimate of the appliance is emitted.
+
+    The emitted estimate refers to the samples that the preprocessing method targets:
+        - ROLLING_WINDOW: the last sample of the window, i.e. the new reading (no delay)
+        - MIDPOINT_WINDOW: the midpoint of the window, window_size - 1 - window_size // 2 samples before the new reading
+        - SEQ_T0_SUBSEQ: the subsequence in the middle of the window, subseq_window values
+    Since the future readings are not known, FILL_INTERPOLATION is approximated by repeating the last valid reading.
+
+    If stateful is True, the recurrent models that support it (check: BaseModel.supports_streaming) advance by one
+    sample per reading with stream_step, carrying their hidden state across the calls, instead of running on the
+    whole window. It is only available with ROLLING_WINDOW. The cost per reading becomes O(1) instead of
+    O(window_size), but the estimates approximate the windowed ones instead of reproducing them, since the forward
+    state of the GRUs is not restarted at the beginning of every window (check: the stream_step of the models). The
+    first estimate is still emitted after window_size readings, so that the state has warmed up.
+
+    Args:
+        model(ClassicTrainingTools or BaseModel): the trained model
+        window_size(int): the input window of the model
+        preprocessing_method(SupportedPreprocessingMethods): the preprocessing method the model was trained with
+            Default: ROLLING_WINDOW
+        subseq_window(int): the output window of a SEQ_T0_SUBSEQ model
+        normalization_method(str): STANDARDIZATION or NORMALIZATION, as in the training dataset
+        mmax, means, stds, meter_means, meter_stds (float): the normalization parameters of the training dataset
+        fillna_method(SupportedFillingMethods): the filling method of the missing readings
+            Default: FILL_ZEROS
+        device(str): the device the model runs on. If None is given, the current device of the model is used.
+        stateful(bool): use the stateful streaming inference of the model
+            Default: False
+
+    Example of use:
+        disaggregator = StreamingDisaggregator(model, window_size=WINDOW, means=train_dataset.means,
+                                               stds=train_dataset.stds, meter_means=train_dataset.meter_means,
+                                               meter_stds=train_dataset.meter_stds)
+        for timestamp, reading in mains_stream:
+            prediction = disaggregator.update(reading, timestamp=timestamp)
+            if prediction is not None:
+                target_timestamp, estimate = prediction
+    """
+    def __init__(self, model: Union[ClassicTrainingTools, BaseModel], window_size: int,
+                 preprocessing_method: SupportedPreprocessingMethods = SupportedPreprocessingMethods.ROLLING_WINDOW,
+                 subseq_window: int = None, normalization_method: str = STANDARDIZATION, mmax: float = None,
+                 means: float = None, stds: float = None, meter_means: float = None, meter_stds: float = None,
+                 fillna_method: SupportedFillingMethods = SupportedFillingMethods.FILL_ZEROS, device: str = None,
+                 stateful: bool = False):
+        if preprocessing_method not in STREAMING_METHODS:
+            raise Exception('Preprocessing method {} is not supported for streaming'.format(preprocessing_method))
+        self.network = model.model if isinstance(model, ClassicTrainingTools) else model
+        # the VIB models decode the mean of the latent distribution, so that the estimates are deterministic
+        self.forward = self.network.forward_inference if self.network.supports_vib() else model
+        if stateful and preprocessing_method != SupportedPreprocessingMethods.ROLLING_WINDOW:
+            raise Exception('Stateful streaming is only supported for {}'
+                            .format(SupportedPreprocessingMethods.ROLLING_WINDOW))
+        if stateful and not self.network.supports_streaming():
+            raise Exception('Model {} does not support stateful streaming'.format(type(self.network).__name__))
+        if not window_size:
+            raise Warning('Window size is not defined.')
+        self.model = model
+        self.window_size = window_size
+        self.preprocessing_method = preprocessing_method
+        self.normalization_method = normalization_method
+        self.mmax = mmax
+        self.means = means
+        self.stds = stds
+        self.meter_means = meter_means
+        self.meter_stds = meter_stds
+        self.fillna_method = fillna_method
+        self.stateful = stateful
+        self.device = torch.device(device) if device else next(model.parameters()).device
+        self.target_offset, self.target_length = self._get_target(preprocessing_method, window_size, subseq_window)
+        self.buffers = {}
+        self.timestamps = {}
+        self.last_valid = {}
+        self.stream_states = {}
+        self.model.to(self.device)
+        self.model.eval()
+
+    @staticmethod
+    def _get_target(preprocessing_method: SupportedPreprocessingMethods, window_size: int,
+                    subseq_window: int = None) -> Tuple[int, int]:
+        """
+        Returns the position of the first targeted sample in the window and the number of targeted samples, the same
+        as the window views of datasources/preprocessing_lib.
+        """
+        if preprocessing_method == SupportedPreprocessingMethods.ROLLING_WINDOW:
+            return window_size - 1, 1
+        elif preprocessing_method == SupportedPreprocessingMethods.MIDPOINT_WINDOW:
+            return window_size // 2, 1
+        if not subseq_window:
+            subseq_window = int(window_size * 0.2)
+        upper_limit = (window_size + subseq_window) // 2
+        lower_limit = (window_size - subseq_window) // 2
+        return lower_limit, upper_limit - lower_limit
+
+    def reset(self, meter=None):
+        """
+        Drops the buffered readings of the given meter, or of all the meters if None is given.
+        """
+        for state in [self.buffers, self.timestamps, self.last_valid, self.stream_states]:
+            if meter is None:
+                state.clear()
+            else:
+                state.pop(meter, None)
+
+    def update(self, reading: float, timestamp=None, meter=0) -> Optional[Tuple[object, np.array]]:
+        """
+        Appends a new mains reading of the given meter. Returns None while the first window is not complete yet,
+        otherwise a tuple with the timestamp (or the index in the stream, if no timestamps are given) of the first
+        targeted sample and the de-normalized estimates of the targeted samples.
+        """
+        if meter not in self.buffers:
+            self.buffers[meter] = RingBuffer(self.window_size)
+            self.timestamps[meter] = RingBuffer(self.window_size, dtype=object)
+            self.last_valid[meter] = 0.0
+        buffer, timestamps = self.buffers[meter], self.timestamps[meter]
+        timestamps.append(buffer.count if timestamp is None else timestamp)
+        buffer.append(self._normalize(self._fill(reading, meter)))
+        if self.stateful:
+            estimates = self._stream_step(buffer.window()[-1], meter)
+            if not buffer.is_full():
+                return None
+        elif not buffer.is_full():
+            return None
+        else:
+            estimates = self._predict_window(buffer.window(), meter)
+        return timestamps.window()[self.target_offset], estimates
+
+    def _fill(self, reading: float, meter) -> float:
+        if reading is None or np.isnan(reading):
+            if self.fillna_method == SupportedFillingMethods.FILL_INTERPOLATION:
+                return self.last_valid[meter]
+            return 0.0
+        self.last_valid[meter] = reading
+        return reading
+
+    def _normalize(self, reading: float) -> float:
+        if self.normalization_method == STANDARDIZATION:
+            return (reading - self.means) / self.stds
+        elif self.normalization_method == NORMALIZATION:
+            return reading / self.mmax
+        return reading
+
+    def _denormalize(self, estimates: np.array) -> np.array:
+        if self.normalization_method == NORMALIZATION and self.mmax:
+            return estimates * self.mmax
+        elif self.meter_means is not None and self.meter_stds is not None:
+            return estimates * self.meter_stds + self.meter_means
+        return estimates
+
+    def _predict_window(self, window: np.array, meter) -> np.array:
+        with torch.inference_mode():
+            inputs = torch.from_numpy(window).to(self.device).unsqueeze(0)
+            outputs = self.forward(inputs)
+            if isinstance(outputs, tuple):
+                # e.g. the VIB models return ((mu, std), outputs)
+                outputs = outputs[-1]
+            estimates = outputs.reshape(-1)[-self.target_length:].float().cpu().numpy()
+        return self._denormalize(estimates)
+
+    def _stream_step(self, reading: float, meter) -> np.array:
+        with torch.inference_mode():
+            if meter not in self.stream_states:
+                self.stream_states[meter] = self.network.init_stream_state(device=self.device)
+            inputs = torch.tensor([reading], dtype=torch.float32, device=self.device)
+            outputs, self.stream_states[meter] = self.network.stream_step(inputs, self.stream_states[meter])
+            estimates = outputs.reshape(-1)[-self.target_length:].float().cpu().numpy()
+        return self._denormalize(estimates)
+
+
+def benchmark_latency(disaggregator: StreamingDisaggregator, num_samples: int = 1000,
+                      latency_bound: float = None, seed: int = 0) -> dict:
+    """
+    Measures the per-sample latency (in seconds) of a streaming disaggregator, after its first window is filled, on
+    random mains readings. If a latency_bound is given (e.g. the sample period), the result reports whether every
+    update finished within it.
+
+    Example of use:
+        report = benchmark_latency(disaggregator, num_samples=10000, latency_bound=SAMPLE_PERIOD)
+    """
+    rng = np.random.RandomState(seed)
+    readings = rng.uniform(0, 3000, size=disaggregator.window_size - 1 + num_samples)
+    meter = 'latency_benchmark'
+    disaggregator.reset(meter)
+    for reading in readings[:disaggregator.window_size - 1]:
+        disaggregator.update(reading, meter=meter)
+
+    latencies = np.empty(num_samples)
+    for i, reading in enumerate(readings[disaggregator.window_size - 1:]):
+        start = time.perf_counter()
+        disaggregator.update(reading, meter=meter)
+        latencies[i] = time.perf_counter() - start
+    disaggregator.reset(meter)
+
+    report = {'mean': latencies.mean(),
+              'p50': np.percentile(latencies, 50),
+              'p99': np.percentile(latencies, 99),
+              'max': latencies.max()}
+    if latency_bound is not None:
+        report['within_bound'] = bool(report['max'] <= latency_bound)
+    return report
@@ -7,7 +7,7 @@ from typing import Dict, Tuple
 import pytorch_lightning as pl
 import torch.nn.functional as F
 from constants.constants import *
-from utils.nilm_metrics import NILMmetrics
+from utils.nilm_metrics import NILMMetricsAccumulator
 from neural_networks.base_models import BaseModel
 from utils.helpers import denormalize, destandardize
 from constants.appliance_thresholds import ON_THRESHOLDS
@@ -74,7 +74,9 @@ class ClassicTrainingTools(pl.LightningModule):
         self.eval_params = eval_params
         self.model_name = self.model.architecture_name
 
-        self.final_preds = np.array([])
+        self.final_preds = []
+        self.metrics_accumulator = NILMMetricsAccumulator(
+            threshold=ON_THRESHOLDS.get(ElectricalAppliances(self.eval_params[COLUMN_DEVICE]), 50))
         self.results = {}
 
     def forward(self, x):
@@ -126,47 +128,59 @@ class ClassicTrainingTools(pl.LightningModule):
         # Forward pass
         outputs = self(x)
         loss = F.mse_loss(outputs.squeeze(), y.squeeze())
-        preds_batch = outputs.squeeze().cpu().numpy()
-        self.final_preds = np.append(self.final_preds, preds_batch)
+        self._collect_preds(outputs, y)
         return {'test_loss': loss}
 
     def test_epoch_end(self, outputs):
         # outputs is a list of whatever you returned in `test_step`
         avg_loss = torch.stack([x['test_loss'] for x in outputs]).mean()
-        if self.model_name == 'DAE':
-            self.final_preds = np.reshape(self.final_preds, (-1))
         res = self._metrics()
         print('#### model name: {} ####'.format(res[COLUMN_MODEL]))
         print('metrics: {}'.format(res[COLUMN_METRICS]))
         self.log("test_test_avg_loss", avg_loss)
         return res
 
-    def _metrics(self):
-        dev, mmax, groundtruth = self.eval_params[COLUMN_DEVICE], \
-                                 self.eval_params[COLUMN_MMAX], \
-                                 self.eval_params[COLUMN_GROUNDTRUTH]
-
+    def _collect_preds(self, outputs: Tensor, labels: Tensor):
+        """
+        The de-normalized predictions and labels of every batch update the metrics accumulator on their device. The
+        predictions are also copied to the cpu asynchronously as float32 and are concatenated once in _gather_preds,
+        instead of reallocating the whole history of predictions on every batch.
+        """
+        outputs = outputs.detach().reshape(-1)
+        self.metrics_accumulator.update(self._denormalize(outputs.double()),
+                                        self._denormalize(labels.detach().reshape(-1).double()))
+        self.final_preds.append(outputs.to(CPU_NAME, dtype=torch.float32, non_blocking=True))
+
+    def _gather_preds(self) -> np.array:
+        if torch.cuda.is_available():
+            # the non-blocking copies have to be finished before the predictions are read
+            torch.cuda.synchronize()
+        if not self.final_preds:
+            return np.array([], dtype=np.float32)
+        return torch.cat(self.final_preds).numpy()
+
+    def _denormalize(self, data):
+        mmax = self.eval_params[COLUMN_MMAX]
         means = self.eval_params[COLUMN_MEANS]
         stds = self.eval_params[COLUMN_STDS]
-
         if mmax:
-            preds = denormalize(self.final_preds, mmax)
-            ground = denormalize(groundtruth, mmax)
+            return denormalize(data, mmax)
         elif means and stds:
-            preds = destandardize(self.final_preds, means, stds)
-            ground = destandardize(groundtruth, means, stds)
+            return destandardize(data, means, stds)
+        return data
 
-        res = NILMmetrics(pred=preds,
-                          ground=ground,
-                          threshold=ON_THRESHOLDS.get(ElectricalAppliances(dev), 50)
-                          )
+    def _metrics(self):
+        preds = self._denormalize(self._gather_preds())
+        ground = self._denormalize(self.eval_params[COLUMN_GROUNDTRUTH])
+        res = self.metrics_accumulator.compute()
 
         results = {COLUMN_MODEL: self.model_name,
                    COLUMN_METRICS: res,
                    COLUMN_PREDICTIONS: preds,
                    COLUMN_GROUNDTRUTH: ground, }
         self.set_res(results)
-        self.final_preds = np.array([])
+        self.final_preds = []
+        self.metrics_accumulator.reset()
         return results
 
     def set_ground(self, ground):
@@ -219,8 +233,7 @@ class VIBTrainingTools(ClassicTrainingTools):
         (mu, std), outputs = self(x)
 
         loss = F.mse_loss(outputs.squeeze(), y.squeeze())
-        preds_batch = outputs.squeeze().cpu().numpy()
-        self.final_preds = np.append(self.final_preds, preds_batch)
+        self._collect_preds(outputs, y)
         return {'test_loss': loss}
 
     def _forward_step(self, batch: Tensor) -> Tuple[Tensor, Tensor]:
@@ -257,17 +270,15 @@ class BayesTrainingTools(ClassicTrainingTools):
     def training_step(self, batch, batch_idx):
         # x must be in shape [batch_size, 1, window_size]
         x, y = batch
-        # Forward pass
-        outputs = self(x)
         # fit_loss = F.mse_loss(outputs.squeeze(1), y)
         # complexity_loss = self.model.nn_kl_divergence()
         # loss = fit_loss + complexity_loss
 
-        loss = self.model.sample_elbo(inputs=x,
-                                      labels=y,
-                                      criterion=self.criterion,
-                                      sample_nbr=self.sample_nbr,
-                                      complexity_cost_weight=1. / x.shape[0])
+        # the ELBO of sample_nbr weight samples, with all the samples drawn in one vectorized forward
+        outputs = self.model.forward_mc(x, self.sample_nbr)
+        labels = y.expand(self.sample_nbr, *y.shape)
+        loss = self.criterion(outputs.reshape(labels.shape), labels)
+        loss = loss + self.model.nn_kl_divergence() * (1. / x.shape[0])
 
         tensorboard_logs = {'train_loss': loss}
         return {'loss': loss, 'log': tensorboard_logs}
@@ -304,8 +315,7 @@ class BertTrainingTools(ClassicTrainingTools):
         x, y = batch
         outputs = self(x)
         loss = self._bert_loss((outputs.squeeze(), y))
-        preds_batch = outputs.squeeze().cpu().numpy()
-        self.final_preds = np.append(self.final_preds, preds_batch)
+        self._collect_preds(outputs, y)
         return {'test_loss': loss}
 
     def validation_step(self, val_batch: Tensor, batch_idx: int) -> Dict:
@@ -369,56 +379,39 @@ class BertTrainingTools(ClassicTrainingTools):
         return data
 
     def _get_appliance_status(self, data):
-        status = np.zeros(data.shape)
-        if len(data.squeeze().shape) == 1:
-            columns = 1
-        else:
-            columns = data.squeeze().shape[-1]
-
+        """
+        Returns the on/off status of the appliance for every sample of the batch, on the device of the data.
+        A sample is on if it is above the threshold. Then the off periods between two on periods that are not longer
+        than min_off are switched on and the on periods that are shorter than min_on are switched off.
+        The time is the last dimension of the data and every sequence of the batch is processed independently.
+        """
         if not self.threshold:
-            self.threshold = [10 for i in range(columns)]
+            self.threshold = torch.tensor(10)
         if not self.min_on:
-            self.min_on = [1 for i in range(columns)]
+            self.min_on = torch.tensor(1)
         if not self.min_off:
-            self.min_off = [1 for i in range(columns)]
-
-        initial_status = data >= self.threshold
-        status_diff = np.diff(initial_status.cpu())
-        events_idx = status_diff.nonzero()
-
-        events_idx = np.array(events_idx).squeeze()
-        events_idx += 1
-
-        if all(initial_status[0]):
-            events_idx = np.insert(events_idx, 0, 0)
-
-        if all(initial_status[-1]):
-            events_idx = np.insert(
-                events_idx, events_idx.size, initial_status.size)
-
-        events_idx = events_idx.reshape((-1, 2))
-        on_events = events_idx[:, 0].copy()
-        off_events = events_idx[:, 1].copy()
-        assert len(on_events) == len(off_events)
-
-        if len(on_events) > 0:
-            off_duration = on_events[1:] - off_events[:-1]
-            off_duration = np.insert(off_duration, 0, 1000)
-            on_events = on_events[off_duration > self.min_off[i]]
-            off_events = off_events[np.roll(
-                off_duration, -1) > self.min_off[i]]
-
-            on_duration = off_events - on_events
-            on_events = on_events[on_duration >= self.min_on[i]]
-            off_events = off_events[on_duration >= self.min_on[i]]
-            assert len(on_events) == len(off_events)
-
-        temp_status = data.clone()
-        temp_status[:] = 0
-        for on, off in zip(on_events, off_events):
-            temp_status[on: off] = 1
-        status = temp_status
-        return status
+            self.min_off = torch.tensor(1)
+
+        status = (data >= self.threshold.to(data.device)).reshape(-1, data.shape[-1])
+        run_ids, run_lengths = self._run_lengths(status)
+        last_run = run_ids[:, -1:]
+        short_off = ~status & (run_lengths <= self.min_off.to(data.device)) & (run_ids > 0) & (run_ids < last_run)
+        status = status | short_off
+
+        _, run_lengths = self._run_lengths(status)
+        status = status & (run_lengths >= self.min_on.to(data.device))
+        return status.reshape(data.shape).to(data.dtype)
+
+    @staticmethod
+    def _run_lengths(status: Tensor) -> Tuple[Tensor, Tensor]:
+        """
+        Run-length encoding of a [batch_size, seq_len] boolean tensor along the sequences. Returns the index of the
+        run of every sample (runs change on every on/off event) and the length of the run every sample belongs to.
+        """
+        events = status[:, 1:] != status[:, :-1]
+        run_ids = F.pad(events.long().cumsum(dim=-1), (1, 0))
+        run_lengths = torch.zeros_like(run_ids).scatter_add_(1, run_ids, torch.ones_like(run_ids))
+        return run_ids, run_lengths.gather(1, run_ids)
 
     def compute_status(self, data):
         columns = data.squeeze().shape[-1]
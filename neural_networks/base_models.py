@@ -28,3 +28,17 @@ class BaseModel(nn.Module, abc.ABC):
         Returns yes if it supports bayesian inference.
         """
         return False
+
+    def supports_dense(self) -> bool:
+        """
+        Returns yes if it supports dense inference on consecutive windows.
+        If yes then the model should implement forward_dense.
+        """
+        return False
+
+    def supports_streaming(self) -> bool:
+        """
+        Returns yes if it supports stateful streaming inference.
+        If yes then the model should implement init_stream_state and stream_step.
+        """
+        return False
@@ -1,3 +1,5 @@
+import math
+
 import torch
 import torch.nn as nn
 from torchnlp.nn import Attention
@@ -8,11 +10,79 @@ from neural_networks.custom_modules import ConvDropRelu, LinearDropRelu
 from blitz.utils import variational_estimator
 
 
+class BatchedBayesianLinear(BayesianLinear):
+    """
+    A BayesianLinear that can also draw num_samples weight samples at once. If num_samples is set, the inputs are
+    num_samples replicas of the batch, [num_samples * batch_size, ..., in_features], and every replica is multiplied
+    with its own weight sample in one batched matmul. The complexity cost is averaged over the samples, the same as
+    the complexity cost of sample_elbo over its sequential forward passes.
+    """
+    def __init__(self, *args, **kwargs):
+        super(BatchedBayesianLinear, self).__init__(*args, **kwargs)
+        self.num_samples = None
+
+    def forward(self, x):
+        if self.freeze or not self.num_samples:
+            return super(BatchedBayesianLinear, self).forward(x)
+
+        w, w_log_posterior, w_log_prior = self._sample(self.weight_sampler, self.weight_prior_dist)
+        if self.bias:
+            b, b_log_posterior, b_log_prior = self._sample(self.bias_sampler, self.bias_prior_dist)
+        else:
+            b = torch.zeros((self.num_samples, self.out_features), device=x.device)
+            b_log_posterior = 0
+            b_log_prior = 0
+        self.log_variational_posterior = w_log_posterior + b_log_posterior
+        self.log_prior = w_log_prior + b_log_prior
+
+        inputs = x.reshape(self.num_samples, -1, self.in_features)
+        outputs = torch.baddbmm(b.unsqueeze(1), inputs, w.transpose(1, 2))
+        return outputs.reshape(*x.shape[:-1], self.out_features)
+
+    def _sample(self, sampler, prior_dist):
+        """
+        Returns num_samples samples of the sampler and their log posterior and log prior, averaged over the samples.
+        """
+        sigma = torch.log1p(torch.exp(sampler.rho))
+        eps = torch.randn((self.num_samples,) + tuple(sampler.mu.shape), device=sampler.mu.device,
+                          dtype=sampler.mu.dtype)
+        samples = sampler.mu + sigma * eps
+        # (w - mu) / sigma is eps, so the log posterior of the samples doesn't need the samples themselves
+        log_posterior = (-math.log(math.sqrt(2 * math.pi)) - torch.log(sigma) - 0.5).sum() \
+            - (eps ** 2).sum() / (2 * self.num_samples)
+        log_prior = prior_dist.log_prior(samples) / self.num_samples
+        return samples, log_posterior, log_prior
+
+
+def monte_carlo_forward(model: nn.Module, x: torch.Tensor, num_samples: int) -> torch.Tensor:
+    """
+    Runs num_samples Monte-Carlo samples of a Bayesian model in one vectorized forward instead of num_samples
+    sequential ones. The batch is replicated num_samples times and every BatchedBayesianLinear of the model draws a
+    weight sample per replica. Returns the outputs of all the samples, [num_samples, batch_size, ...].
+    """
+    layers = [module for module in model.modules() if isinstance(module, BatchedBayesianLinear)]
+    for layer in layers:
+        layer.num_samples = num_samples
+    try:
+        outputs = model(x.repeat(num_samples, *[1] * (x.dim() - 1)))
+    finally:
+        for layer in layers:
+            layer.num_samples = None
+    return outputs.reshape(num_samples, len(x), *outputs.shape[1:])
+
+
 @variational_estimator
 class BAYESNet(BaseModel):
     def supports_bayes(self) -> bool:
         return True
 
+    def forward_mc(self, x, num_samples: int = 10):
+        """
+        Returns the outputs of num_samples weight samples, [num_samples, batch_size, output_dim]
+        (check: monte_carlo_forward). Their mean and variance are the predictive mean and variance of the model.
+        """
+        return monte_carlo_forward(self, x, num_samples)
+
 
 class BayesWGRU(BAYESNet):
     def supports_bayes(self) -> bool:
@@ -34,18 +104,18 @@ class BayesWGRU(BAYESNet):
         #                  dropout=self.drop)
 
         self.dense1 = nn.Sequential(
-            BayesianLinear(512, 128,
-                           prior_sigma_1=0.8,
-                           prior_sigma_2=0.1,
-                          ),
+            BatchedBayesianLinear(512, 128,
+                                  prior_sigma_1=0.8,
+                                  prior_sigma_2=0.1,
+                                 ),
             nn.Dropout(dropout),
             nn.ReLU(inplace=True),
         )
         self.dense2 = nn.Sequential(
-            BayesianLinear(128, 64,
-                           #prior_sigma_1=0.1,#prior_pi=0.5, posterior_rho_init=-10.0,
-                        #    prior_sigma_2=0.5,
-                          ),
+            BatchedBayesianLinear(128, 64,
+                                  #prior_sigma_1=0.1,#prior_pi=0.5, posterior_rho_init=-10.0,
+                               #    prior_sigma_2=0.5,
+                                 ),
             nn.Dropout(dropout),
             nn.ReLU(inplace=True),
         )
@@ -95,10 +165,10 @@ class BayesSimpleGru(BAYESNet):
                            bidirectional=True,
                            dropout=self.drop)
         self.dense = nn.Sequential(
-            BayesianLinear(128, 64,
-                           prior_sigma_1=s1,
-                           prior_sigma_2=s2,
-                          ),
+            BatchedBayesianLinear(128, 64,
+                                  prior_sigma_1=s1,
+                                  prior_sigma_2=s2,
+                                 ),
             nn.ReLU(inplace=True),
         )
         # self.dense = LinearDropRelu(128, 64, self.drop)
@@ -142,7 +212,7 @@ class BayesSeq2Point(BAYESNet):
             ConvDropRelu(50, 50, kernel_size=5, dropout=0),
             nn.Flatten()
         )
-        self.dense = BayesianLinear(self.dense_input, 1024)
+        self.dense = BatchedBayesianLinear(self.dense_input, 1024)
         self.output = nn.Linear(1024, 1)
 
     def forward(self, x):
@@ -168,21 +238,21 @@ class BayesNFEDBLock(BAYESNet):
         self.consider_inverse_fft = inverse_fft
         s1 = 0.05
         s2 = 0.01
-        self.linear_fftout = BayesianLinear(2*input_dim, input_dim,
-                                            prior_sigma_1=s1,
-                                            prior_sigma_2=s2,
-                                           )
+        self.linear_fftout = BatchedBayesianLinear(2*input_dim, input_dim,
+                                                   prior_sigma_1=s1,
+                                                   prior_sigma_2=s2,
+                                                  )
         # Two-layer MLP
         self.linear_net = nn.Sequential(
-            BayesianLinear(input_dim, hidden_dim,
-                           prior_sigma_1=s1,
-                           prior_sigma_2=s2,
-                          ),
+            BatchedBayesianLinear(input_dim, hidden_dim,
+                                  prior_sigma_1=s1,
+                                  prior_sigma_2=s2,
+                                 ),
             nn.Dropout(dropout),
             nn.ReLU(inplace=True),
-            BayesianLinear(hidden_dim, input_dim,
-                           prior_sigma_1=s1,
-                           prior_sigma_2=s2,)
+            BatchedBayesianLinear(hidden_dim, input_dim,
+                                  prior_sigma_1=s1,
+                                  prior_sigma_2=s2,)
         )
 
         # Layers to apply in between the main layers
@@ -267,7 +337,7 @@ class BayesNFEDBLock(BAYESNet):
 #         return x, imag
 
 
-class BayesNFED(BaseModel):
+class BayesNFED(BAYESNet):
 
     def __init__(self, depth, kernel_size, cnn_dim, output_dim=1, **block_args):
         super(BayesNFED, self).__init__()
@@ -352,20 +422,20 @@ class BayesSAED(BAYESNet):
                            dropout=self.drop)
         if bidirectional:
             self.dense = nn.Sequential(
-                BayesianLinear(128, 64,
-                               prior_sigma_1=s1,
-                               prior_sigma_2=s2,
-                               ),
+                BatchedBayesianLinear(128, 64,
+                                      prior_sigma_1=s1,
+                                      prior_sigma_2=s2,
+                                      ),
                 nn.Dropout(dropout),
                 nn.ReLU(inplace=True),
             )
             self.output = nn.Linear(64, output_dim)
         else:
             self.dense = nn.Sequential(
-                BayesianLinear(64, 32,
-                               prior_sigma_1=s1,
-                               prior_sigma_2=s2,
-                               ),
+                BatchedBayesianLinear(64, 32,
+                                      prior_sigma_1=s1,
+                                      prior_sigma_2=s2,
+                                      ),
                 nn.Dropout(dropout),
                 nn.ReLU(inplace=True),
             )
@@ -120,6 +120,6 @@ class VIBDecoder(nn.Module):
 
     def forward(self, x):
         encoding = x.unsqueeze(1)
-        decoding = self.conv(encoding).squeeze()
+        decoding = self.conv(encoding)
         decoding = self.flatten(decoding)
         return self.feedforward(decoding)
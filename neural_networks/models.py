@@ -7,6 +7,31 @@ from neural_networks.base_models import BaseModel
 from neural_networks.custom_modules import ConvDropRelu, LinearDropRelu
 
 
+def stream_conv(conv: nn.Module, inputs: torch.Tensor, count: int) -> torch.Tensor:
+    """
+    Applies a ConvDropRelu(kernel_size=4) on the last 4 samples of a stream, [batch_size, 4]. Returns
+    [batch_size, 2, channels]: the output of the previous sample, which now has its right neighbour, and the output of
+    the newest sample, which is zero-padded on the right exactly like the last sample of a window.
+    On the first sample of the stream only the output of the newest sample is returned.
+    """
+    outputs = conv(inputs.unsqueeze(1)).permute(0, 2, 1)
+    return outputs[:, 2:] if count else outputs[:, 3:]
+
+
+def stream_gru(gru: nn.GRU, inputs: torch.Tensor, hidden: torch.Tensor):
+    """
+    Advances a single layer (bidirectional) GRU by one sample. The forward direction continues from the hidden state
+    that is carried across the calls, while the backward direction starts from zero on the given inputs, like it does
+    at the end of a window. Returns the outputs, [batch_size, len(inputs), directions * hidden_size], and the forward
+    hidden state after the previous sample, which is the state to carry to the next call.
+    """
+    h0 = torch.cat((hidden, torch.zeros_like(hidden)), 0) if gru.bidirectional else hidden
+    outputs = gru(inputs, h0)[0]
+    if inputs.size(1) > 1:
+        hidden = outputs[:, 0, :gru.hidden_size].unsqueeze(0).contiguous()
+    return outputs, hidden
+
+
 class GELU(nn.Module):
     def forward(self, x):
         return 0.5 * x * (1 + torch.tanh(math.sqrt(2 / math.pi) * (x + 0.044715 * torch.pow(x, 3))))
@@ -91,6 +116,41 @@ class Seq2Point(BaseModel):
         out = self.output(x)
         return out
 
+    def supports_dense(self) -> bool:
+        return True
+
+    def forward_dense(self, x):
+        """
+        Dense inference on consecutive rolling windows, x of shape [batch_size, window_size], where every window is
+        the previous one shifted by one sample. The convolutions run once over the series that the windows span and
+        the features of every window are a view of the features of the series. The zero padding of every window only
+        changes the features of its first and last samples (within the receptive field of the convolutions), so only
+        these halos are recomputed per window. The outputs are equal to the outputs of forward up to floating point
+        error, while the convolutions cost O(1) instead of O(window_size) per window. If the windows are not
+        consecutive, it falls back to forward.
+        """
+        batch_size, window_size = x.shape
+        left, right = self._receptive_field()
+        if batch_size < 2 or window_size <= left + right or not torch.equal(x[1:, :-1], x[:-1, 1:]):
+            return self.forward(x)
+
+        conv = self.conv[:-1]
+        features = conv(torch.cat((x[0], x[1:, -1])).view(1, 1, -1))[0]
+        features = features.unfold(1, window_size, 1).permute(1, 0, 2).contiguous()
+        features[:, :, :left] = conv(x[:, :left + right].unsqueeze(1))[:, :, :left]
+        features[:, :, -right:] = conv(x[:, -(left + right):].unsqueeze(1))[:, :, -right:]
+
+        x = self.dense(features.flatten(1))
+        out = self.output(x)
+        return out
+
+    def _receptive_field(self):
+        """
+        Returns how many samples on the left and on the right of a position the features of the convolutions see.
+        """
+        paddings = [module.conv[0].padding for module in self.conv if isinstance(module, ConvDropRelu)]
+        return sum(padding[0] for padding in paddings), sum(padding[1] for padding in paddings)
+
 
 class WGRU(BaseModel):
 
@@ -134,6 +194,35 @@ class WGRU(BaseModel):
         out = self.output(x)
         return out
 
+    def supports_streaming(self) -> bool:
+        return True
+
+    def init_stream_state(self, batch_size: int = 1, device=None) -> dict:
+        return {'inputs': torch.zeros(batch_size, 3, device=device),
+                'count': 0,
+                'hidden': [torch.zeros(1, batch_size, self.b1.hidden_size, device=device),
+                           torch.zeros(1, batch_size, self.b2.hidden_size, device=device)]}
+
+    def stream_step(self, x, state: dict):
+        """
+        Stateful streaming inference: advances the model by one new sample, x of shape [batch_size], with one
+        2-step call of every GRU instead of running both GRUs over the whole window. The newest position is computed
+        exactly like the last position of a window, but the carried forward states have seen the whole stream instead
+        of only the window, and the first GRU outputs of the past positions that the second GRU has consumed had only
+        one sample of look-ahead instead of the rest of the window. So the outputs approximate the windowed ones,
+        with O(1) instead of O(window_size) cost per sample, and the approximation is coarser than in SimpleGru
+        because of the stacked bidirectional layers.
+        """
+        inputs = torch.cat((state['inputs'], x.reshape(-1, 1)), 1)
+        x = stream_conv(self.conv1, inputs, state['count'])
+        x, hidden1 = stream_gru(self.b1, x, state['hidden'][0])
+        x, hidden2 = stream_gru(self.b2, x, state['hidden'][1])
+        x = x[:, -1, :]
+        x = self.dense1(x)
+        x = self.dense2(x)
+        out = self.output(x)
+        return out, {'inputs': inputs[:, 1:], 'count': state['count'] + 1, 'hidden': [hidden1, hidden2]}
+
 
 class SAED(BaseModel):
 
@@ -252,6 +341,31 @@ class SimpleGru(BaseModel):
         out = self.output(x)
         return out
 
+    def supports_streaming(self) -> bool:
+        return True
+
+    def init_stream_state(self, batch_size: int = 1, device=None) -> dict:
+        return {'inputs': torch.zeros(batch_size, 3, device=device),
+                'count': 0,
+                'hidden': [torch.zeros(1, batch_size, self.bgru.hidden_size, device=device)]}
+
+    def stream_step(self, x, state: dict):
+        """
+        Stateful streaming inference: advances the model by one new sample, x of shape [batch_size], with one 2-step
+        GRU call instead of running the GRU over the whole window. The backward direction at the newest position is
+        exactly the windowed one (a single step from zero), so the output is the output of forward on the whole stream
+        so far and the only difference from the windowed mode is that the carried forward state has not been restarted
+        at the beginning of the window. The outputs approximate the windowed ones as the GRU forgets the samples older
+        than the window, with O(1) instead of O(window_size) cost per sample.
+        """
+        inputs = torch.cat((state['inputs'], x.reshape(-1, 1)), 1)
+        x = stream_conv(self.conv, inputs, state['count'])
+        x, hidden = stream_gru(self.bgru, x, state['hidden'][0])
+        x = x[:, -1, :]
+        x = self.dense(x)
+        out = self.output(x)
+        return out, {'inputs': inputs[:, 1:], 'count': state['count'] + 1, 'hidden': [hidden]}
+
 
 class DAE(BaseModel):
     def __init__(self, input_dim, dropout=0.2, output_dim=1):
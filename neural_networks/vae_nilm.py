@@ -88,6 +88,12 @@ class VAE(VIBNet):
         mu = statistics[:, :self.K]
         std = F.softplus(statistics[:, self.K:], beta=1)
         z = self.reparametrize_n(mu, std, current_epoch, num_sample, self.max_noise)
+        if num_sample > 1:
+            # every latent sample is decoded with the same skip connections, in one batched pass
+            z = self.flatten_samples(z)
+            conv_seq1, conv_seq2, conv_seq3, conv_seq4, conv_seq5, conv_seq6, conv_seq7 = \
+                [skip.repeat(num_sample, 1, 1) for skip in [conv_seq1, conv_seq2, conv_seq3, conv_seq4,
+                                                              conv_seq5, conv_seq6, conv_seq7]]
         reshape1 = self.reshape1(z).unsqueeze(1)
         dconv_seq4, _ = self.dconv_seq4(reshape1)
         dconc5 = torch.cat((dconv_seq4, conv_seq7), 1)
@@ -115,6 +121,6 @@ class VAE(VIBNet):
 
         dconv_seq10, _ = self.dconv_seq10(deconv6)
         dconc17 = torch.cat((dconv_seq10, conv_seq1), 1)
-        outputs = self.outputs(dconc17).squeeze(1)
+        outputs = self.average_samples(self.outputs(dconc17).squeeze(1), num_sample)
 
         return (mu, std), outputs
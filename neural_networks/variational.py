@@ -52,6 +52,34 @@ class VIBNet(BaseModel):
 
         return mu + eps * std
 
+    @staticmethod
+    def flatten_samples(encoding: torch.Tensor) -> torch.Tensor:
+        """
+        Flattens the [num_sample, batch_size, K] latent samples of reparametrize_n to [num_sample * batch_size, K], so
+        that all the samples are decoded in one batched pass. A single sample, [batch_size, K], is returned as is.
+        """
+        return encoding.reshape(-1, encoding.size(-1))
+
+    @staticmethod
+    def average_samples(outputs: torch.Tensor, num_sample: int = 1) -> torch.Tensor:
+        """
+        Averages the outputs of the decoded flatten_samples over the latent samples.
+        """
+        if num_sample == 1:
+            return outputs
+        return outputs.reshape(num_sample, -1, *outputs.shape[1:]).mean(0)
+
+    def forward_inference(self, x, num_sample: int = None):
+        """
+        Inference of a trained model. By default the mean of the latent distribution is decoded, which is
+        deterministic and needs a single decoder pass. If num_sample is given, num_sample noisy latent samples, the
+        same as in training, are decoded in one batched pass and their outputs are averaged.
+        """
+        if num_sample:
+            # the latent noise is only added after the first epoch (check: reparametrize_n)
+            return self(x, current_epoch=1, num_sample=num_sample)
+        return self(x, current_epoch=0)
+
     def weight_init(self):
         for m in self._modules:
             xavier_init(self._modules[m])
@@ -86,7 +114,7 @@ class VIB_SAED(SAED, VIBNet):
         mu = statistics[:, :self.K]
         std = F.softplus(statistics[:, self.K:], beta=1)
         encoding = self.reparametrize_n(mu, std, current_epoch, num_sample, self.max_noise)
-        logit = self.decoder(encoding)
+        logit = self.average_samples(self.decoder(self.flatten_samples(encoding)), num_sample)
 
         return (mu, std), logit
 
@@ -102,6 +130,9 @@ class VIB_SimpleGru(SimpleGru, VIBNet):
             self.dense = LinearDropRelu(64, 2 * K, self.drop)
         self.decoder = VIBDecoder(self.K, output_dim=output_dim)
 
+    def supports_streaming(self) -> bool:
+        return False
+
     def forward(self, x, current_epoch=None, num_sample=1):
         x = x.unsqueeze(1)
         x = self.conv(x)
@@ -113,7 +144,7 @@ class VIB_SimpleGru(SimpleGru, VIBNet):
         mu = statistics[:, :self.K]
         std = F.softplus(statistics[:, self.K:], beta=1)
         encoding = self.reparametrize_n(mu, std, current_epoch, num_sample, self.max_noise)
-        logit = self.decoder(encoding)
+        logit = self.average_samples(self.decoder(self.flatten_samples(encoding)), num_sample)
 
         return (mu, std), logit
 
@@ -126,6 +157,9 @@ class VIBWGRU(WGRU, VIBNet):
         self.dense2 = LinearDropRelu(128, 2 * K, self.drop)
         self.decoder = VIBDecoder(self.K, output_dim=output_dim)
 
+    def supports_streaming(self) -> bool:
+        return False
+
     def forward(self, x, current_epoch=None, num_sample=1):
         x = x.unsqueeze(1)
         x = self.conv1(x)
@@ -138,7 +172,7 @@ class VIBWGRU(WGRU, VIBNet):
         mu = statistics[:, :self.K]
         std = F.softplus(statistics[:, self.K:], beta=1)
         encoding = self.reparametrize_n(mu, std, current_epoch, num_sample, self.max_noise)
-        logit = self.decoder(encoding)
+        logit = self.average_samples(self.decoder(self.flatten_samples(encoding)), num_sample)
 
         return (mu, std), logit
 
@@ -161,7 +195,7 @@ class VIBSeq2Point(Seq2Point, VIBNet):
         std = F.softplus(statistics[:, self.K:], beta=1)
         encoding = self.reparametrize_n(mu, std, current_epoch, num_sample, self.max_noise)
 
-        logit = self.decoder(encoding)
+        logit = self.average_samples(self.decoder(self.flatten_samples(encoding)), num_sample)
 
         return (mu, std), logit
 
@@ -197,7 +231,7 @@ class VIBNFED(NFED, VIBNet):
         # encoding =  torch.cat((x_in, encoding), dim=-1)
         encoding = x_in + encoding
         # print(encoding.shape)
-        logit = self.decoder(encoding)
+        logit = self.average_samples(self.decoder(self.flatten_samples(encoding)), num_sample)
 
         return (mu, std), logit
 
@@ -0,0 +1,74 @@
+import os
+import json
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+from datasources.columnar_datasource import ColumnarDatasource, MANIFEST_FILE, TIMESTAMPS_FILE, VALUES_FILE, MAINS, \
+    APPLIANCES, MAX_SAMPLE_PERIODS, BUILDINGS, TIMEZONE
+
+START_DATE = '2014-01-01'
+END_DATE = '2014-01-02'
+SAMPLE_PERIOD = 6
+
+
+class SyntheticDatasource:
+    """
+    -SyntheticDatasource
+
+    A datasource with the interface of Datasource (get_mains_generator, get_appliance_generator) that yields the
+    chunks of random mains & appliance series, so that the datasets can be tested without a NILMTK HDF5 file.
+    """
+    thread_safe = False
+
+    def __init__(self, n: int = 5000, name: str = 'SYNTHETIC', seed: int = 0, path: str = None):
+        rng = np.random.RandomState(seed)
+        index = pd.date_range(START_DATE, periods=n, freq='{}s'.format(SAMPLE_PERIOD), tz='Europe/London')
+        self.mains = pd.Series(rng.rand(n).astype(np.float32) * 1000, index=index)
+        self.meter = pd.Series(rng.rand(n).astype(np.float32) * 100, index=index)
+        self.name = name
+        self.path = path
+
+    def get_name(self):
+        return self.name
+
+    def get_path(self):
+        return self.path
+
+    def get_mains_generator(self, start: str, end: str, sample_period: int = SAMPLE_PERIOD, building: int = 1,
+                            chunksize: int = 1000) -> Iterator[pd.Series]:
+        return self._generator(self.mains, start, end, chunksize)
+
+    def get_appliance_generator(self, appliance: str, start: str, end: str, sample_period: int = SAMPLE_PERIOD,
+                                building: int = 1, chunksize: int = None) -> Iterator[pd.Series]:
+        return self._generator(self.meter, start, end, chunksize)
+
+    @staticmethod
+    def _generator(series: pd.Series, start: str, end: str, chunksize: int) -> Iterator[pd.Series]:
+        tz = series.index.tz
+        series = series[(series.index >= pd.Timestamp(start).tz_localize(tz))
+                        & (series.index < pd.Timestamp(end).tz_localize(tz))]
+        chunksize = chunksize or len(series)
+        for i in range(0, len(series), chunksize):
+            yield series.iloc[i:i + chunksize].copy()
+
+
+def write_columnar_store(root: str, name: str = 'SYNTHETIC', n: int = 5000, seed: int = 0,
+                         appliance: str = 'kettle', max_sample_period: float = 30) -> ColumnarDatasource:
+    """
+    Writes the mains (meter 1) and the appliance (meter 2) of a single building in the layout of a columnar store
+    (check: datasources/columnar_datasource) and returns the datasource that reads them.
+    """
+    datasource = SyntheticDatasource(n=n, seed=seed)
+    for instance, series in enumerate([datasource.mains, datasource.meter], 1):
+        meter_dir = os.path.join(root, name, 'building1', 'meter{}'.format(instance))
+        os.makedirs(meter_dir, exist_ok=True)
+        np.save(os.path.join(meter_dir, TIMESTAMPS_FILE), series.index.asi8)
+        np.save(os.path.join(meter_dir, VALUES_FILE), series.values.astype(np.float32))
+    manifest = {TIMEZONE: 'Europe/London',
+                BUILDINGS: {'1': {MAINS: [1], APPLIANCES: {appliance: [2]},
+                                  MAX_SAMPLE_PERIODS: {'1': max_sample_period, '2': max_sample_period}}}}
+    with open(os.path.join(root, name, MANIFEST_FILE), 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    return ColumnarDatasource(name, root)
@@ -0,0 +1,67 @@
+import math
+import threading
+
+import pytest
+
+pytest.importorskip('nilmtk')
+pytest.importorskip('pytorch_lightning')
+
+import torch
+from torch.utils.data import DataLoader
+
+from datasources.chunk_reader import PrefetchingChunkReader
+from datasources.torchdataset import ElectricityIterableDataset
+from tests.synthetic import SyntheticDatasource, START_DATE, END_DATE, SAMPLE_PERIOD
+
+WINDOW_SIZE = 50
+BATCH_SIZE = 32
+CHUNKSIZE = 1000
+NUM_POINTS = 5000
+
+
+def make_dataset():
+    return ElectricityIterableDataset(datasource=SyntheticDatasource(n=NUM_POINTS),
+                                      building=1,
+                                      device='kettle',
+                                      dates=[START_DATE, END_DATE],
+                                      window_size=WINDOW_SIZE,
+                                      sample_period=SAMPLE_PERIOD,
+                                      chunksize=CHUNKSIZE,
+                                      batch_size=BATCH_SIZE)
+
+
+def test_reader_starts_thread_lazily():
+    datasource = SyntheticDatasource(n=3000)
+    reader = PrefetchingChunkReader(datasource.get_mains_generator(START_DATE, END_DATE, chunksize=CHUNKSIZE),
+                                    datasource.get_appliance_generator('kettle', START_DATE, END_DATE,
+                                                                       chunksize=CHUNKSIZE))
+    assert reader.thread is None
+    chunks = list(reader)
+    assert len(chunks) == 3
+    assert reader.thread is None
+
+
+def test_no_thread_is_alive_after_construction():
+    threads = threading.active_count()
+    dataset = make_dataset()
+    assert threading.active_count() == threads
+    assert getattr(dataset, 'chunk_reader', None) is None or dataset.chunk_reader.thread is None
+
+
+def test_len_matches_the_batches():
+    dataset = make_dataset()
+    batches = list(DataLoader(dataset, batch_size=None, num_workers=0))
+    assert len(dataset) == len(batches)
+    assert dataset.data_len == sum(len(x) for x, _ in batches)
+
+
+@pytest.mark.parametrize('num_workers', [2])
+def test_iterate_with_workers(num_workers):
+    dataset = make_dataset()
+    expected = torch.cat([x for x, _ in DataLoader(dataset, batch_size=None, num_workers=0)])
+    loader = DataLoader(dataset, batch_size=None, num_workers=num_workers, timeout=60)
+    epochs = [torch.cat([x for x, _ in loader]) for _ in range(2)]
+    # every chunk is partitioned among the workers, so up to num_workers - 1 windows of each chunk are dropped
+    chunks = math.ceil(NUM_POINTS / CHUNKSIZE)
+    assert len(expected) - chunks * (num_workers - 1) <= len(epochs[0]) <= len(expected)
+    assert torch.equal(epochs[0], epochs[1])
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from datasources.columnar_datasource import resample_meter, export_to_columnar, ColumnarDatasource
+
+SECOND = 10 ** 9
+SAMPLE_PERIOD = 6
+MAX_SAMPLE_PERIOD = 30
+START_DATE = '2014-01-01'
+END_DATE = '2014-01-02'
+NAME = 'SYNTHETIC'
+TIMEZONE = 'Europe/London'
+
+
+@pytest.mark.parametrize('gap', [12, 30, 36, 60, 120])
+def test_resample_meter_fills_up_to_max_sample_period(gap):
+    # like NILMTK, the empty bins after a measurement are forward filled up to ceil(max_sample_period / period)
+    timestamps = np.array([0, gap * SECOND], dtype=np.int64)
+    first_bin, values = resample_meter(timestamps, np.array([1., 2.], dtype=np.float32), None, None,
+                                       SAMPLE_PERIOD * SECOND, MAX_SAMPLE_PERIOD)
+    limit = int(np.ceil(MAX_SAMPLE_PERIOD / SAMPLE_PERIOD))
+    empty_bins = gap // SAMPLE_PERIOD - 1
+    assert first_bin == 0
+    assert np.isnan(values).sum() == max(empty_bins - limit, 0)
+    assert values[-1] == 2.
+
+
+def gappy_meter(n: int, seed: int) -> pd.DataFrame:
+    """
+    A meter sampled every SAMPLE_PERIOD seconds with gaps that are shorter and longer than MAX_SAMPLE_PERIOD.
+    """
+    rng = np.random.RandomState(seed)
+    index = pd.date_range(START_DATE, periods=n, freq='{}s'.format(SAMPLE_PERIOD), tz=TIMEZONE)
+    keep = np.ones(n, dtype=bool)
+    for start, length in [(100, 3), (400, 5), (700, 6), (1000, 20), (1500, 100)]:
+        keep[start:start + length] = False
+    columns = pd.MultiIndex.from_tuples([('power', 'active')], names=['physical_quantity', 'type'])
+    return pd.DataFrame(rng.rand(keep.sum()).astype(np.float32) * 1000, index=index[keep], columns=columns)
+
+
+def write_nilmtk_dataset(path: str, n: int = 3000):
+    from nilmtk.datastore import HDFDataStore
+
+    store = HDFDataStore(path, 'w')
+    for instance in [1, 2]:
+        store.put('/building1/elec/meter{}'.format(instance), gappy_meter(n, seed=instance))
+    store.save_metadata('/', {
+        'name': NAME,
+        'timezone': TIMEZONE,
+        'meter_devices': {'meter': {'model': 'meter', 'sample_period': SAMPLE_PERIOD,
+                                    'max_sample_period': MAX_SAMPLE_PERIOD,
+                                    'measurements': [{'physical_quantity': 'power', 'type': 'active'}]}},
+    })
+    store.save_metadata('/building1', {
+        'instance': 1,
+        'elec_meters': {1: {'device_model': 'meter', 'site_meter': True,
+                            'data_location': '/building1/elec/meter1'},
+                        2: {'device_model': 'meter', 'submeter_of': 1,
+                            'data_location': '/building1/elec/meter2'}},
+        'appliances': [{'type': 'kettle', 'instance': 1, 'meters': [2]}],
+    })
+    store.close()
+
+
+def concatenate(generator) -> pd.Series:
+    chunks = list(generator)
+    return pd.concat(chunks) if chunks else pd.Series(dtype=np.float32)
+
+
+@pytest.mark.parametrize('sample_period', [SAMPLE_PERIOD, 60])
+def test_columnar_matches_nilmtk(tmp_path, sample_period):
+    pytest.importorskip('nilmtk')
+    from nilmtk import DataSet
+    from datasources.datasource import Datasource
+
+    path = str(tmp_path / 'synthetic.h5')
+    write_nilmtk_dataset(path)
+    export_to_columnar(NAME, path, output_dir=str(tmp_path / 'columnar'))
+    datasource = Datasource(DataSet(path), NAME, path)
+    columnar = ColumnarDatasource(NAME, str(tmp_path / 'columnar'))
+    try:
+        expected = [concatenate(datasource.get_mains_generator(START_DATE, END_DATE, sample_period, 1, 1000)),
+                    concatenate(datasource.get_appliance_generator('kettle', START_DATE, END_DATE, sample_period, 1,
+                                                                   1000))]
+        actual = [concatenate(columnar.get_mains_generator(START_DATE, END_DATE, sample_period, 1, 1000)),
+                  concatenate(columnar.get_appliance_generator('kettle', START_DATE, END_DATE, sample_period, 1,
+                                                               1000))]
+    finally:
+        datasource.close()
+    for expected_series, actual_series in zip(expected, actual):
+        assert expected_series.isna().any()
+        pd.testing.assert_index_equal(actual_series.index, expected_series.index)
+        np.testing.assert_allclose(actual_series.values, expected_series.values, rtol=1e-5)
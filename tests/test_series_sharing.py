@@ -0,0 +1,52 @@
+import os
+
+import pytest
+
+pytest.importorskip('nilmtk')
+pytest.importorskip('pytorch_lightning')
+
+import numpy as np
+
+from datasources.series_cache import AlignedSeries, share_series, receive_series
+from datasources.torchdataset import ElectricityMultiBuildingsDataset
+from tests.synthetic import write_columnar_store, START_DATE, END_DATE, SAMPLE_PERIOD
+
+SHM_DIR = '/dev/shm'
+
+pytestmark = pytest.mark.skipif(not os.path.isdir(SHM_DIR), reason='the shared memory blocks are not listed')
+
+
+def shared_blocks():
+    return {name for name in os.listdir(SHM_DIR) if name.startswith('psm_')}
+
+
+def make_train_info(datasource, buildings):
+    return [{'device': 'kettle', 'datasource': datasource, 'building': building, 'dates': [START_DATE, END_DATE]}
+            for building in buildings]
+
+
+def test_share_and_receive():
+    blocks = shared_blocks()
+    series = AlignedSeries(np.arange(10, dtype=np.int64), np.random.rand(10), np.random.rand(10), 'Europe/London')
+    received = receive_series(share_series(series))
+    np.testing.assert_array_equal(received.mains, series.mains)
+    assert shared_blocks() == blocks
+
+
+def test_parallel_loading(tmp_path):
+    blocks = shared_blocks()
+    datasource = write_columnar_store(str(tmp_path))
+    dataset = ElectricityMultiBuildingsDataset(train_info=make_train_info(datasource, [1, 1]), window_size=50,
+                                               sample_period=SAMPLE_PERIOD)
+    assert len(dataset) == 2 * len(dataset.mainchunks[0])
+    assert shared_blocks() == blocks
+
+
+def test_failing_worker_releases_shared_memory(tmp_path):
+    blocks = shared_blocks()
+    datasource = write_columnar_store(str(tmp_path))
+    # the worker of building 2, which is not in the store, raises before the series of building 1 are received
+    with pytest.raises(KeyError):
+        ElectricityMultiBuildingsDataset(train_info=make_train_info(datasource, [2, 1, 1]), window_size=50,
+                                         sample_period=SAMPLE_PERIOD)
+    assert shared_blocks() == blocks
@@ -3,66 +3,82 @@ import numpy as np
 from constants.constants import*
 
 
+class NILMMetricsAccumulator:
+    """
+    -NILMMetricsAccumulator
+
+    Accumulates the sufficient statistics of the NILM metrics (TP/FP/FN/TN counts, the sum of the absolute errors and
+    the energy sums of the predictions and the ground truth) batch by batch, so that the metrics can be calculated
+    without keeping the whole prediction array in memory. The batches can be numpy arrays or tensors; tensors are
+    reduced on their own device and nothing is copied to the cpu until compute is called. The inputs are not modified.
+
+    Args:
+        threshold(float): the on-power threshold of the appliance
+            Default: 40
+
+    Example of use:
+        accumulator = NILMMetricsAccumulator(threshold=ON_THRESHOLDS.get(device, 50))
+        for preds_batch, ground_batch in batches:
+            accumulator.update(preds_batch, ground_batch)
+        metrics = accumulator.compute()
+    """
+    def __init__(self, threshold: float = 40):
+        self.threshold = threshold
+        self.reset()
+
+    def reset(self):
+        self.samples = 0
+        self.tp, self.fp, self.fn, self.tn = 0, 0, 0, 0
+        self.abs_error, self.pred_energy, self.ground_energy = 0, 0, 0
+
+    def update(self, pred, ground):
+        pr = self._as_tensor(pred)
+        gr = self._as_tensor(ground)
+        pr = torch.where(torch.isnan(pr), torch.zeros_like(pr), pr)
+        gr = torch.where(torch.isnan(gr), torch.zeros_like(gr), gr)
+
+        self.samples += len(pr)
+        self.pred_energy = self.pred_energy + pr.sum(dtype=torch.float64)
+        self.ground_energy = self.ground_energy + gr.sum(dtype=torch.float64)
+        self.abs_error = self.abs_error + (pr.double() - gr.double()).abs().sum()
+
+        states_pred = pr >= self.threshold
+        states_ground = gr >= self.threshold
+        self.tp = self.tp + (states_pred & states_ground).sum()
+        self.fp = self.fp + (states_pred & ~states_ground).sum()
+        self.fn = self.fn + (~states_pred & states_ground).sum()
+        self.tn = self.tn + (~states_pred & ~states_ground).sum()
+
+    def compute(self, round_digit: int = 3) -> dict:
+        # numpy scalars keep the behaviour of the metrics on empty classes (nan instead of ZeroDivisionError)
+        tp, fp, fn, tn = [np.int64(self._item(count)) for count in [self.tp, self.fp, self.fn, self.tn]]
+        e_pred, e_ground, abs_error = [np.float64(self._item(total))
+                                       for total in [self.pred_energy, self.ground_energy, self.abs_error]]
+
+        rete = round(abs(e_pred - e_ground) / float(max(e_pred, e_ground)), round_digit)
+        mae = round(abs_error / self.samples, round_digit)
+
+        recall = round(tp / float(tp + fn), round_digit)
+        precision = round(tp / float(tp + fp), round_digit)
+        f1 = round(2 * (precision * recall) / float(precision + recall), round_digit)
+        accuracy = round((tp + tn) / float(self.samples), round_digit)
+
+        return {COLUMN_RECALL: recall, COLUMN_PRECISION: precision,
+                COLUMN_F1: f1, COLUMN_ACCURACY: accuracy,
+                COLUMN_MAE: mae, COLUMN_RETE: rete}
+
+    @staticmethod
+    def _as_tensor(data) -> torch.Tensor:
+        if torch.is_tensor(data):
+            return data.detach().reshape(-1)
+        return torch.from_numpy(np.ascontiguousarray(data)).reshape(-1)
+
+    @staticmethod
+    def _item(value):
+        return value.item() if torch.is_tensor(value) else value
+
+
 def NILMmetrics(pred: np.array, ground: np.array, threshold: int = 40, round_digit: int = 3):
-    def tp_tn_fp_fn(states_pred, states_ground):
-        tp = np.sum(np.logical_and(states_pred == 1, states_ground == 1))
-        fp = np.sum(np.logical_and(states_pred == 1, states_ground == 0))
-        fn = np.sum(np.logical_and(states_pred == 0, states_ground == 1))
-        tn = np.sum(np.logical_and(states_pred == 0, states_ground == 0))
-        return tp, tn, fp, fn
-
-    def recall(tp, fn):
-        return tp/float(tp+fn)
-
-    def precision(tp, fp):
-        return tp/float(tp+fp)
-
-    def f1(prec, rec):
-        return 2 * (prec*rec) / float(prec+rec)
-
-    def accuracy(tp, tn, p, n):
-        return (tp + tn) / float(p + n)
-
-    def relative_error_total_energy(predictions, groundtruth):
-        e_pred = sum(predictions)
-        e_ground = sum(groundtruth)
-        return abs(e_pred - e_ground) / float(max(e_pred, e_ground))
-
-    def mean_absolute_error(predictions, groundtruth):
-        sum_samples = len(predictions)
-        total_sum = sum(abs(predictions - groundtruth))
-        return total_sum / sum_samples
-
-    if torch.is_tensor(pred):
-        pr = pred.numpy()
-    else:
-        pr = pred
-
-    if torch.is_tensor(ground):
-        gr = ground.numpy()
-    else:
-        gr = ground
-
-    pr[np.isnan(pr)] = 0
-    gr[np.isnan(gr)] = 0
-
-    rete = round(relative_error_total_energy(pr, gr), round_digit)
-    mae = mean_absolute_error(pr, gr)
-    mae = round(mae, round_digit)
-
-    pr = np.array([0 if p < threshold else 1 for p in pr])
-    gr = np.array([0 if p < threshold else 1 for p in gr])
-
-    tp, tn, fp, fn = tp_tn_fp_fn(pr, gr)
-    positives = sum(pr)
-    negatives = len(pr) - positives
-
-    recall = round(recall(tp, fn), round_digit)
-    precision = round(precision(tp, fp), round_digit)
-    f1 = round(f1(precision,recall), round_digit)
-    accuracy = round(accuracy(tp, tn, positives, negatives), round_digit)
-
-    metrics_results = {COLUMN_RECALL: recall, COLUMN_PRECISION: precision,
-                       COLUMN_F1: f1, COLUMN_ACCURACY: accuracy,
-                       COLUMN_MAE: mae, COLUMN_RETE: rete}
-    return metrics_results
+    accumulator = NILMMetricsAccumulator(threshold=threshold)
+    accumulator.update(pred, ground)
+    return accumulator.compute(round_digit=round_digit)
@@ -228,5 +228,7 @@ def save_appliance_report(root_dir: str = None, model_name: str = None, device:
         cols = [COLUMN_GROUNDTRUTH, COLUMN_PREDICTIONS]
         res_data = pd.DataFrame(list(zip(ground, preds)),
                                 columns=cols)
+        if COLUMN_PREDICTIONS_VARIANCE in model_results:
+            res_data[COLUMN_PREDICTIONS_VARIANCE] = model_results[COLUMN_PREDICTIONS_VARIANCE]
         res_data.to_csv(path + data_filename, index=False)
         print('Time series saved at: ', path + data_filename)